@@ -0,0 +1,148 @@
+import asyncio
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Admission control: a token bucket per client, so no one client can turn
+# searches into upstream calls faster than `rate`, and a cap on the upstream
+# calls in flight, with a short bounded queue in front of it. Whatever doesn't
+# fit in the queue is turned away at once instead of tying up a worker thread.
+
+# Refills at `rate` tokens a second, holding at most `burst`
+class TokenBucket:
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    # Take a token, returning 0 if there was one, or else the seconds until there will be
+    def take(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+# One token bucket per client, forgetting the least recently seen beyond `max_clients`
+class RateLimiter:
+    def __init__(self, rate, burst, max_clients=10000, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self.clock = clock
+        self.allowed = 0
+        self.limited = 0
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    # 0 if `client` may go ahead, or else the whole seconds it should wait
+    def check(self, client):
+        with self._lock:
+            now = self.clock()
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = self._buckets[client] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_clients:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(client)
+            wait = bucket.take(now)
+            if wait:
+                self.limited += 1
+                return max(1, math.ceil(wait))
+            self.allowed += 1
+            return 0
+
+    def stats(self):
+        with self._lock:
+            return {'allowed': self.allowed, 'limited': self.limited, 'clients': len(self._buckets)}
+
+class _Limiter:
+    def __init__(self, limit, max_waiting, timeout):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+
+    def stats(self):
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'shed': self.shed,
+        }
+
+# At most `limit` holders at once. Up to `max_waiting` more callers wait for a
+# slot, for at most `timeout` seconds (or the timeout given to acquire());
+# acquire() returns False for the rest.
+class ConcurrencyLimiter(_Limiter):
+    def __init__(self, limit, max_waiting=0, timeout=0):
+        super().__init__(limit, max_waiting, timeout)
+        self._slots = threading.Semaphore(limit)
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        acquired = self._slots.acquire(blocking=False)
+        if not acquired:
+            with self._lock:
+                if self.waiting >= self.max_waiting:
+                    self.shed += 1
+                    return False
+                self.waiting += 1
+                self.queued += 1
+            try:
+                acquired = self._slots.acquire(timeout=max(self.timeout if timeout is None else timeout, 0))
+            finally:
+                with self._lock:
+                    self.waiting -= 1
+        with self._lock:
+            if not acquired:
+                self.shed += 1
+                return False
+            self.active += 1
+            self.admitted += 1
+        return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+        self._slots.release()
+
+# The same for coroutines sharing one event loop
+class AsyncConcurrencyLimiter(_Limiter):
+    def __init__(self, limit, max_waiting=0, timeout=0):
+        super().__init__(limit, max_waiting, timeout)
+        self._slots = asyncio.Semaphore(limit)
+
+    async def acquire(self, timeout=None):
+        if self._slots.locked():
+            if self.waiting >= self.max_waiting:
+                self.shed += 1
+                return False
+            self.waiting += 1
+            self.queued += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), max(self.timeout if timeout is None else timeout, 0))
+            except asyncio.TimeoutError:
+                self.shed += 1
+                return False
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        self.active += 1
+        self.admitted += 1
+        return True
+
+    def release(self):
+        self.active -= 1
+        self._slots.release()
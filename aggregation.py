@@ -0,0 +1,71 @@
+from array import array
+from datetime import datetime
+from functools import lru_cache
+
+RENEWABLE_FUELS = ('wind', 'solar', 'hydro')
+
+# Bucket sizes in minutes that divide a day evenly and line up with settlement periods
+BUCKET_SIZES = (30, 60, 180)
+
+# Start of the bucket containing a "%Y-%m-%dT%H:%MZ" timestamp. The same few
+# hundred timestamps recur across regions and requests, so results are memoised.
+@lru_cache(maxsize=4096)
+def bucket_start(timestamp, bucket_minutes=60):
+    minute_of_day = int(timestamp[11:13]) * 60 + int(timestamp[14:16])
+    minute_of_day -= minute_of_day % bucket_minutes
+    return datetime(int(timestamp[0:4]), int(timestamp[5:7]), int(timestamp[8:10]),
+                    minute_of_day // 60, minute_of_day % 60)
+
+# Average the share of `fuels` in the generation mix over buckets of `bucket_minutes`.
+# Returns {bucket start: {'count', 'total_renewable_perc', 'average_renewable_perc'}}
+# in first-seen order, plus a 'fuels' breakdown of per-fuel averages when `breakdown` is set.
+def aggregate_generation_mix(rows, bucket_minutes=60, fuels=RENEWABLE_FUELS, breakdown=False):
+    if bucket_minutes not in BUCKET_SIZES:
+        raise ValueError(f"bucket_minutes must be one of {BUCKET_SIZES}")
+
+    slots = {fuel: i for i, fuel in enumerate(fuels)}
+    width = len(fuels)
+    empty = [0] * width
+
+    buckets = {}
+    counts = array('l')
+    combined = array('d')
+    per_fuel = array('d')
+
+    for entry in rows:
+        bucket = bucket_start(entry['from'], bucket_minutes)
+        index = buckets.get(bucket)
+        if index is None:
+            index = buckets[bucket] = len(counts)
+            counts.append(0)
+            combined.append(0.0)
+            if breakdown:
+                per_fuel.extend(empty)
+
+        # One pass over the mix picks out every fuel we are interested in
+        values = list(empty)
+        for item in entry['generationmix']:
+            slot = slots.get(item['fuel'])
+            if slot is not None:
+                values[slot] = item['perc']
+
+        counts[index] += 1
+        combined[index] += sum(values)
+        if breakdown:
+            base = index * width
+            for slot in range(width):
+                per_fuel[base + slot] += values[slot]
+
+    result = {}
+    for bucket, index in buckets.items():
+        count = counts[index]
+        data = {
+            'count': count,
+            'total_renewable_perc': combined[index],
+            'average_renewable_perc': round(combined[index] / count),
+        }
+        if breakdown:
+            base = index * width
+            data['fuels'] = {fuel: round(per_fuel[base + slot] / count, 1) for fuel, slot in slots.items()}
+        result[bucket] = data
+    return result
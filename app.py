@@ -1,99 +1,493 @@
+import contextvars
+import csv
+import gzip
+import hashlib
+import io
+import json
 import os
-from flask import Flask, request, render_template_string
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from flask import Flask, Response, g, has_app_context, request, render_template, jsonify, stream_with_context, url_for
+from markupsafe import Markup
+from werkzeug.middleware.proxy_fix import ProxyFix
 import requests
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from admission import ConcurrencyLimiter, RateLimiter
+from aggregation import aggregate_generation_mix
+from forecast_cache import SETTLEMENT_PERIOD, ForecastCache, settlement_period_start
+from metrics import Family, MultiprocessStore, Registry, histogram_samples
+from outcodes import REGION_NAMES, OutcodeIndex, parse_postcode
+from palette import Palette
+from prewarmer import ForecastPrewarmer
+from snapshot_store import SnapshotStore, SnapshotWriter
+from upstream import UpstreamClient
 
 app = Flask(__name__)
 
-# Function to convert full postcode to outward code using Postcodes.io
+# Static files are fingerprinted by static_url(), so they can be cached for a year
+app.config['SEND_FILE_MAX_AGE_DEFAULT'] = 365 * 24 * 60 * 60
+
+# Content hash of each static file, so a deploy that changes it also changes its URL
+static_versions = {}
+
+def static_url(filename):
+    version = static_versions.get(filename)
+    if version is None:
+        with open(os.path.join(app.static_folder, filename), 'rb') as f:
+            version = static_versions[filename] = hashlib.sha1(f.read()).hexdigest()[:12]
+    return url_for('static', filename=filename, v=version)
+
+app.jinja_env.globals['static_url'] = static_url
+# Keep block tags from leaving blank lines in the page
+app.jinja_env.trim_blocks = True
+app.jinja_env.lstrip_blocks = True
+
+POSTCODES_API_URL = os.environ.get("POSTCODES_API_URL", "https://api.postcodes.io")
+CARBON_INTENSITY_API_URL = os.environ.get("CARBON_INTENSITY_API_URL", "https://api.carbonintensity.org.uk")
+
+# At most UPSTREAM_MAX_CONCURRENT upstream calls run at once in a worker. Up to
+# UPSTREAM_MAX_QUEUED more wait UPSTREAM_QUEUE_TIMEOUT seconds for a turn; the
+# rest are answered from the cache, marked stale, without calling out.
+UPSTREAM_MAX_CONCURRENT = int(os.environ.get("UPSTREAM_MAX_CONCURRENT", 10))
+UPSTREAM_MAX_QUEUED = int(os.environ.get("UPSTREAM_MAX_QUEUED", 20))
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get("UPSTREAM_QUEUE_TIMEOUT", 2))
+upstream_limiter = ConcurrencyLimiter(
+    UPSTREAM_MAX_CONCURRENT, UPSTREAM_MAX_QUEUED, UPSTREAM_QUEUE_TIMEOUT) if UPSTREAM_MAX_CONCURRENT > 0 else None
+
+# Seconds an upstream call may take in all, retries included. A search makes at
+# most two calls one after the other (Postcodes.io, then the forecast), so the
+# default keeps a search inside the 30 seconds Heroku's router allows.
+UPSTREAM_DEADLINE = float(os.environ.get("UPSTREAM_DEADLINE", 12))
+
+upstream = UpstreamClient(
+    connect_timeout=float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.environ.get("UPSTREAM_READ_TIMEOUT", 10)),
+    retries=int(os.environ.get("UPSTREAM_RETRIES", 2)),
+    pool_size=int(os.environ.get("UPSTREAM_POOL_SIZE", 10)),
+    limiter=upstream_limiter,
+    deadline=UPSTREAM_DEADLINE,
+)
+
+# Searches a minute each client IP may make, in bursts of up to SEARCH_RATE_BURST; 0 turns the limit off
+SEARCH_RATE_LIMIT = float(os.environ.get("SEARCH_RATE_LIMIT", 30))
+rate_limiter = RateLimiter(
+    SEARCH_RATE_LIMIT / 60, int(os.environ.get("SEARCH_RATE_BURST", 10))) if SEARCH_RATE_LIMIT > 0 else None
+RATE_LIMITED_ENDPOINTS = {'index', 'api_forecast', 'api_forecast_batch'}
+
+# Proxies in front of the app that add the client's address to X-Forwarded-For
+# (Heroku's router is one), so each client is limited by its own address
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS)
+
+metrics = Registry()
+request_seconds = metrics.histogram(
+    'http_request_duration_seconds', "Time to handle a request, by endpoint")
+responses_total = metrics.counter(
+    'http_responses_total', "Responses sent, by endpoint and status code")
+rate_limited_total = metrics.counter(
+    'search_rate_limited_total', "Searches refused because the client was over its rate limit, by endpoint")
+stage_seconds = metrics.histogram(
+    'search_stage_duration_seconds', "Time spent in each stage of a search",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+
+# Requests that send "X-Server-Timing: 1" get their stage timings back in a
+# Server-Timing header, unless SERVER_TIMING=0
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "1") == "1"
+
+# Where asgi.py collects a search's stage timings; Flask requests use g.server_timing
+server_timing_spans = contextvars.ContextVar('server_timing_spans', default=None)
+
+# Time a stage of handling a search, for /metrics and the Server-Timing header
+@contextmanager
+def timed_stage(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, stage=stage)
+        spans = g.get('server_timing') if has_app_context() else None
+        if spans is None:
+            spans = server_timing_spans.get()
+        if spans is not None:
+            spans.append((stage, elapsed))
+
+def server_timing_header(spans):
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in spans)
+
+# Upstream client stats to export, by client name
+upstream_stats_sources = {'threaded': upstream.stats}
+# Upstream concurrency limiters to export, by client name
+upstream_limiters = {'threaded': upstream_limiter} if upstream_limiter else {}
+
+PREWARM_FORECASTS = os.environ.get("PREWARM_FORECASTS", "0") == "1"
+PREWARM_CONCURRENCY = int(os.environ.get("PREWARM_CONCURRENCY", 4))
+
+# An empty path turns the snapshot off. The default is named after the upstream
+# URLs, so an app pointed at a stub never loads the stub's forecasts as real ones.
+def default_snapshot_path():
+    upstreams = hashlib.sha1(f"{POSTCODES_API_URL} {CARBON_INTENSITY_API_URL}".encode('utf-8')).hexdigest()[:12]
+    return os.path.join(tempfile.gettempdir(), f"forecast-snapshot-{upstreams}.sqlite3")
+
+FORECAST_SNAPSHOT_PATH = os.environ.get("FORECAST_SNAPSHOT_PATH", default_snapshot_path())
+snapshot_store = SnapshotStore(FORECAST_SNAPSHOT_PATH) if FORECAST_SNAPSHOT_PATH else None
+
+# Write each new forecast and outward code through to the snapshot, in the background
+snapshot_writer = SnapshotWriter(snapshot_store) if snapshot_store else None
+
+palette = Palette(band_width=int(os.environ.get("TILE_COLOR_BAND_WIDTH", 5)))
+
+# "inline" gives every tile its exact colour in a style attribute; "class" gives
+# it one CSS class per band from /palette.css, which makes the page smaller
+TILE_COLOR_MODE = os.environ.get("TILE_COLOR_MODE", "inline")
+app.jinja_env.globals['palette'] = palette
+app.jinja_env.globals['tile_color_classes'] = TILE_COLOR_MODE == "class"
+
+# "1" streams search results: the page shell is sent before the forecast is
+# fetched, and the tiles follow once it arrives
+STREAM_SEARCH_RESULTS = os.environ.get("STREAM_SEARCH_RESULTS", "0") == "1"
+
+# Where calendar.html may send what it has rendered so far ahead of the rest
+FLUSH = Markup('<!--flush-->')
+
+BATCH_MAX_POSTCODES = int(os.environ.get("BATCH_MAX_POSTCODES", 100))
+
+API_TIME_FORMAT = "%Y-%m-%dT%H:%MZ"
+CSV_COLUMNS = ['postcode', 'outcode', 'regionid', 'region', 'stale', 'from', 'to', 'percentage', 'color', 'error']
+
+outcode_index = OutcodeIndex.load(on_learn=snapshot_writer.save_outcode if snapshot_writer else None)
+
+# Outward codes Postcodes.io has confirmed but whose region we haven't learned yet
+confirmed_outcodes = set()
+
+# Postcodes Postcodes.io has said don't exist, forgetting the least recently
+# seen beyond `max_size`, so searching for the same bad postcode again doesn't
+# cost another lookup
+class UnknownPostcodes:
+    def __init__(self, max_size=5000):
+        self.max_size = max_size
+        self._postcodes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, postcode):
+        with self._lock:
+            if postcode not in self._postcodes:
+                return False
+            self._postcodes.move_to_end(postcode)
+            return True
+
+    def add(self, postcode):
+        with self._lock:
+            self._postcodes[postcode] = None
+            self._postcodes.move_to_end(postcode)
+            if len(self._postcodes) > self.max_size:
+                self._postcodes.popitem(last=False)
+
+unknown_postcodes = UnknownPostcodes(int(os.environ.get("UNKNOWN_POSTCODES_MAX", 5000)))
+
+LOOKUP_UNAVAILABLE_MESSAGE = "Sorry, we couldn't check this postcode just now. Please try again in a moment."
+
+# Raised when a postcode needs checking with Postcodes.io but the call fails or
+# is turned away, so it can't be told whether the postcode is valid
+class PostcodeLookupUnavailable(Exception):
+    pass
+
+# Function to convert full postcode to outward code, parsed locally where the
+# outward code is known and checked with Postcodes.io otherwise
 def convert_to_outward_code(postcode):
-    response = requests.get(f"https://api.postcodes.io/postcodes/{postcode}")
+    load_snapshot()
+    parsed = parse_postcode(postcode)
+    if parsed is None:
+        return None
+    outward_code = parsed[0]
+    if outward_code in confirmed_outcodes or outcode_index.region_for(outward_code) is not None:
+        return outward_code
+
+    normalised = ' '.join(parsed)
+    if normalised in unknown_postcodes:
+        return None
+    outward_code = lookup_outward_code(normalised)
+    if outward_code:
+        confirmed_outcodes.add(outward_code)
+    return outward_code
+
+# Look the postcode up on Postcodes.io
+def lookup_outward_code(postcode):
+    try:
+        response = upstream.get(f"{POSTCODES_API_URL}/postcodes/{postcode}")
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to look up postcode: {e}")
+        raise PostcodeLookupUnavailable(str(e)) from e
     if response.status_code == 200:
-        data = response.json()
-        if data['status'] == 200:
-            outward_code = data['result']['outcode']
-            return outward_code.upper()
+        return parse_postcode_lookup(response.json())
+    if response.status_code == 404:
+        unknown_postcodes.add(postcode)
     return None
 
-# Fetch renewable energy data for the specified postcode
-def fetch_combined_data(postcode):
-    current_datetime = datetime.utcnow()
-    fw48h_start = current_datetime.strftime("%Y-%m-%dT%H:%MZ")
-    fw48h_url = f"https://api.carbonintensity.org.uk/regional/intensity/{fw48h_start}/fw48h/postcode/{postcode}"
-    
+# Postcodes.io's bulk lookup takes at most this many postcodes a call
+POSTCODES_BULK_LIMIT = 100
+
+# Look many postcodes up on Postcodes.io, with one call per POSTCODES_BULK_LIMIT.
+# Returns the outward code of each postcode, or None for those it doesn't know.
+def lookup_outward_codes(postcodes):
+    found = {}
+    for start in range(0, len(postcodes), POSTCODES_BULK_LIMIT):
+        chunk = postcodes[start:start + POSTCODES_BULK_LIMIT]
+        try:
+            response = upstream.post(f"{POSTCODES_API_URL}/postcodes", json={'postcodes': chunk})
+            response.raise_for_status()
+            results = response.json()['result']
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f"Failed to look up postcodes: {e}")
+            raise PostcodeLookupUnavailable(str(e)) from e
+        for entry in results:
+            if entry['result'] is None:
+                unknown_postcodes.add(entry['query'])
+                found[entry['query']] = None
+            else:
+                found[entry['query']] = entry['result']['outcode'].upper()
+    return found
+
+# Outward codes for a batch of postcodes, as (postcode, outward code, error) in
+# the order given. Those that need checking are checked in bulk, and each costs
+# `client` a rate limit token.
+def convert_batch_to_outward_codes(postcodes, client):
+    load_snapshot()
+    results = {}
+    to_look_up = {}
+    for i, postcode in enumerate(postcodes):
+        parsed = parse_postcode(postcode)
+        if parsed is None:
+            results[i] = (None, "Invalid postcode")
+            continue
+        outward_code = parsed[0]
+        if outward_code in confirmed_outcodes or outcode_index.region_for(outward_code) is not None:
+            results[i] = (outward_code, None)
+            continue
+        normalised = ' '.join(parsed)
+        if normalised in unknown_postcodes:
+            results[i] = (None, "Invalid postcode")
+            continue
+        if normalised not in to_look_up and rate_limiter is not None and rate_limiter.check(client):
+            rate_limited_total.inc(endpoint='api_forecast_batch')
+            results[i] = (None, "Too many postcode lookups. Please wait a moment and try again.")
+            continue
+        to_look_up.setdefault(normalised, []).append(i)
+
+    if to_look_up:
+        try:
+            found = lookup_outward_codes(list(to_look_up))
+        except PostcodeLookupUnavailable:
+            found = None
+        for normalised, indexes in to_look_up.items():
+            if found is None:
+                result = (None, LOOKUP_UNAVAILABLE_MESSAGE)
+            elif found.get(normalised):
+                confirmed_outcodes.add(found[normalised])
+                result = (found[normalised], None)
+            else:
+                result = (None, "Invalid postcode")
+            for i in indexes:
+                results[i] = result
+    return [(postcode, *results[i]) for i, postcode in enumerate(postcodes)]
+
+def parse_postcode_lookup(data):
+    if data['status'] == 200:
+        outward_code = data['result']['outcode']
+        return outward_code.upper()
+    return None
+
+CARBON_INTENSITY_URL = CARBON_INTENSITY_API_URL + "/regional/intensity/{start}/fw48h"
+
+forecast_cache = ForecastCache(
+    max_entries=int(os.environ.get("FORECAST_CACHE_SIZE", 64)),
+    on_store=snapshot_writer.save_forecast if snapshot_writer else None,
+)
+
+snapshot_loaded = False
+snapshot_lock = threading.Lock()
+
+# Fill the cache and outcode index from the snapshot the first time this worker
+# needs them, so a restart doesn't send every first search to the upstream
+def load_snapshot():
+    global snapshot_loaded
+    if snapshot_loaded or snapshot_store is None:
+        return
+    with snapshot_lock:
+        if snapshot_loaded:
+            return
+        try:
+            for outward_code, region_id in snapshot_store.load_outcodes().items():
+                outcode_index.learn(outward_code, region_id, notify=False)
+            for window_start, forecast in snapshot_store.load_forecasts():
+                forecast_cache.put(forecast['regionid'], window_start, forecast, notify=False)
+        except (sqlite3.Error, ValueError) as e:
+            print(f"Failed to load snapshot: {e}")
+        snapshot_loaded = True
+
+# URL of a 48-hour forecast starting at the given settlement period
+def region_forecast_url(path, window_start):
+    fw48h_start = window_start.strftime("%Y-%m-%dT%H:%MZ")
+    return CARBON_INTENSITY_URL.format(start=fw48h_start) + path
+
+# Fetch one region's 48-hour forecast from the Carbon Intensity API
+def fetch_region_forecast(path, window_start):
+    response = upstream.get(region_forecast_url(path, window_start))
+    response.raise_for_status()
+    return parse_region_forecast(response.json())
+
+def parse_region_forecast(payload):
+    data = payload['data']
+    return {
+        'regionid': data.get('regionid'),
+        'shortname': data.get('shortname', 'Unknown Region'),
+        'data': data['data'],
+    }
+
+# Fetch every region's 48-hour forecast with a single call
+def fetch_all_region_forecasts(window_start):
+    response = upstream.get(region_forecast_url("", window_start))
+    response.raise_for_status()
+
+    forecasts = {}
+    for period in response.json()['data']:
+        for region in period['regions']:
+            forecast = forecasts.get(region['regionid'])
+            if forecast is None:
+                forecast = forecasts[region['regionid']] = {
+                    'regionid': region['regionid'],
+                    'shortname': region.get('shortname', 'Unknown Region'),
+                    'data': [],
+                }
+            forecast['data'].append({
+                'from': period['from'],
+                'to': period['to'],
+                'intensity': region.get('intensity'),
+                'generationmix': region['generationmix'],
+            })
+    return list(forecasts.values())
+
+# Fetch each of the regions' forecasts separately, a few at a time
+def fetch_each_region_forecast(window_start, region_ids=REGION_NAMES):
+    forecasts = []
+    error = None
+    with ThreadPoolExecutor(max_workers=PREWARM_CONCURRENCY) as pool:
+        futures = [pool.submit(fetch_region_forecast, f"/regionid/{region_id}", window_start)
+                   for region_id in region_ids]
+        for future in futures:
+            try:
+                forecasts.append(future.result())
+            except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+                error = e
+    if not forecasts and error is not None:
+        raise error
+    return forecasts
+
+# Raised when a refresh got some regions' forecasts but not all of them
+class IncompleteRefresh(Exception):
+    pass
+
+# Refresh the cached forecast of every region for the given settlement period.
+# Regions that already have it are skipped, so a retry after a partial failure
+# only fetches the rest.
+def refresh_all_forecasts(window_start):
+    missing = [region_id for region_id in REGION_NAMES if not forecast_cache.has(region_id, window_start)]
+    if len(missing) == len(REGION_NAMES):
+        try:
+            forecasts = fetch_all_region_forecasts(window_start)
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f"Failed to fetch all regions at once, fetching them one by one: {e}")
+            forecasts = fetch_each_region_forecast(window_start)
+    else:
+        forecasts = fetch_each_region_forecast(window_start, missing)
+    for forecast in forecasts:
+        forecast_cache.put(forecast['regionid'], window_start, forecast)
+
+    # Fail, so the pre-warmer tries again for the missing regions after its retry
+    # delay; meanwhile searches for them get their previous forecast
+    missing = [region_id for region_id in REGION_NAMES if not forecast_cache.has(region_id, window_start)]
+    if missing:
+        raise IncompleteRefresh(f"No forecast for regions {', '.join(map(str, missing))}")
+
+prewarmer = ForecastPrewarmer(refresh_all_forecasts)
+
+# Drop the rows of a stale forecast that are already in the past
+def current_rows(forecast, window_start):
+    current = window_start.strftime("%Y-%m-%dT%H:%MZ")
+    return [row for row in forecast['data'] if row['to'] > current]
+
+# Fetch the forecast of the outward code's region for a settlement period, from
+# the cache where possible; None if it can't be had
+def fetch_forecast(postcode, window_start):
+    load_snapshot()
+    region_id = outcode_index.region_for(postcode)
+
     try:
-        response = requests.get(fw48h_url)
-        response.raise_for_status()
+        if region_id is not None:
+            # While the pre-warmer is running, requests never wait on the upstream
+            # for a region it has already fetched once
+            return forecast_cache.get_or_load(
+                region_id, window_start,
+                lambda: fetch_region_forecast(f"/regionid/{region_id}", window_start),
+                stale_ok=prewarmer.running)
+
+        # The region is unknown until the API tells us, so learn it from the first answer
+        forecast = forecast_cache.coalesce(
+            ('postcode', postcode, window_start),
+            lambda: fetch_region_forecast(f"/postcode/{postcode}", window_start))
+        if forecast['regionid'] is not None:
+            outcode_index.learn(postcode, forecast['regionid'])
+            forecast_cache.put(forecast['regionid'], window_start, forecast)
+        return forecast
     except requests.exceptions.RequestException as e:
         print(f"Failed to fetch data: {e}")
-        return [], None
-    
-    data = response.json()
-    
-    # Extract the region name from the response
-    region_name = data['data'].get('shortname', 'Unknown Region')
-    
-    return data['data']['data'], region_name
+        return stale_forecast(region_id)
+
+# The region's previous forecast, marked stale, for when the current one can't be fetched
+def stale_forecast(region_id):
+    return forecast_cache.get_stale(region_id) if region_id is not None else None
+
+# Fetch renewable energy data for the specified postcode: the rows, region name
+# and whether they come from an earlier forecast
+def fetch_combined_data(postcode):
+    window_start = settlement_period_start()
+    forecast = fetch_forecast(postcode, window_start)
+    if forecast is None:
+        return [], None, False
+    return current_rows(forecast, window_start), forecast['shortname'], forecast.get('stale', False)
 
 # Create a color based on the percentage of wind, solar, and hydro energy
 def create_tile_color(average_percentage):
-    if average_percentage < 25:
-        return "rgb(230, 230, 230)"  # Light grey for percentages under 25%
-    elif average_percentage < 50:
-        green_color = (173, 255, 47)  # Light green (lime green base)
-        light_grey_color = (230, 230, 230)
-        factor = (average_percentage - 25) / 25
-        factor = min(max(factor, 0), 1)
-        color = tuple(int(light_grey_color[i] * (1 - factor) + green_color[i] * factor) for i in range(3))
-    elif average_percentage < 70:
-        strong_green_color = (50, 205, 50)  # Lime green
-        light_green_color = (173, 255, 47)
-        factor = (average_percentage - 50) / 20
-        factor = min(max(factor, 0), 1)
-        color = tuple(int(light_green_color[i] * (1 - factor) + strong_green_color[i] * factor) for i in range(3))
-    else:
-        luminous_green_color = (0, 255, 0)  # Very bright green
-        strong_green_color = (50, 205, 50)
-        factor = (average_percentage - 70) / 30
-        factor = min(max(factor, 0), 1)
-        color = tuple(int(strong_green_color[i] * (1 - factor) + luminous_green_color[i] * factor) for i in range(3))
-    
-    return f"rgb({color[0]},{color[1]},{color[2]})"
+    return palette.color(average_percentage)
 
 # Group data by hour and calculate the average for each hour, including hydro
 def group_data_by_hour(combined_data):
-    hourly_data = {}
-    
-    for entry in combined_data:
-        timestamp = datetime.strptime(entry['from'], "%Y-%m-%dT%H:%MZ")
-        hour = timestamp.replace(minute=0)  # Use the hour, discard minutes
-        
-        wind_perc = next((item['perc'] for item in entry['generationmix'] if item['fuel'] == 'wind'), 0)
-        solar_perc = next((item['perc'] for item in entry['generationmix'] if item['fuel'] == 'solar'), 0)
-        hydro_perc = next((item['perc'] for item in entry['generationmix'] if item['fuel'] == 'hydro'), 0)
-        
-        # Include hydro in the combined renewable percentage
-        combined_renewable_perc = wind_perc + solar_perc + hydro_perc
-        
-        if hour not in hourly_data:
-            hourly_data[hour] = {'count': 0, 'total_renewable_perc': 0}
-        
-        hourly_data[hour]['count'] += 1
-        hourly_data[hour]['total_renewable_perc'] += combined_renewable_perc
-    
-    # Calculate the average for each hour
-    for hour in hourly_data:
-        hourly_data[hour]['average_renewable_perc'] = round(hourly_data[hour]['total_renewable_perc'] / hourly_data[hour]['count'])
-    
-    return hourly_data
+    return aggregate_generation_mix(combined_data, bucket_minutes=60)
 
 # Generate an HTML file for the energy calendar
 def generate_html_calendar(postcode, region_name):
-    combined_data, _ = fetch_combined_data(postcode)
-    
+    combined_data, _, stale = fetch_combined_data(postcode)
+    return render_html_calendar(postcode, region_name, combined_data, stale)
+
+# Render the energy calendar from forecast data that has already been fetched
+def render_html_calendar(postcode, region_name, combined_data, stale=False):
     if not combined_data:
         return "<p>Sorry, no data is available for the postcode '{}'. Please try entering another postcode.</p>".format(postcode)
     
+    with timed_stage('aggregate'):
+        tiles = build_tiles(combined_data)
+    with timed_stage('render'):
+        return render_template('calendar.html', tiles=tiles, postcode=postcode, region_name=region_name, stale=stale)
+
+# Hourly tiles for the calendar and the API: the hour, its renewable share and colour
+def build_tiles(combined_data):
     # Group data by hour and calculate the average
     hourly_data = group_data_by_hour(combined_data)
     
@@ -109,201 +503,82 @@ def generate_html_calendar(postcode, region_name):
         time_str = hour.strftime("%H:%M")
         day_of_week = hour.strftime("%A")
         
-        tiles.append({'color': color, 'time': time_str, 'date': day_of_week, 'percentage': average_renewable_perc})
+        css_class = palette.css_class(average_renewable_perc) if TILE_COLOR_MODE == "class" else None
+        
+        tiles.append({'color': color, 'css_class': css_class, 'time': time_str, 'date': day_of_week, 'percentage': average_renewable_perc, 'hour': hour})
         count += 1  # Increment counter to ensure exactly 48 tiles
     
-    # Ensure a 48-tile layout with 16 tiles per row
-    calendar_html = '''
-<html>
-<head>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <style>
-        * {
-            box-sizing: border-box;  /* Ensure padding/margin are included in the width */
-        }
+    return tiles
 
-        body {
-            font-family: 'Arial', sans-serif;
-            background-color: #f7f9fb;
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            color: #333;
-        }
-
-        .header {
-            text-align: center;
-            background-color: #4CAF50;
-            font-family: 'Arial', sans-serif;
-            padding: 30px 20px;
-            font-size: 36px;
-            color: white;
-            box-shadow: 0 4px 8px rgba(0, 0, 0, 0.1);
-            letter-spacing: 1px;
-            text-transform: uppercase;
-        }
-
-        .postcode-form {
-            text-align: center;
-            margin-bottom: 10px;
-            margin-top: 20px;
-            font-size: 18px;
-        }
-
-        .postcode-form input[type="text"] {
-            font-size: 18px;
-            padding: 12px;
-            width: 260px;
-            margin-right: 15px;
-            border-radius: 6px;
-            border: 1px solid #ccc;
-            box-shadow: inset 0 1px 3px rgba(0, 0, 0, 0.1);
-            transition: box-shadow 0.3s ease;
-        }
-
-        .postcode-form input[type="text"]:focus {
-            outline: none;
-            box-shadow: inset 0 2px 6px rgba(0, 0, 0, 0.2);
-        }
-
-        .postcode-form input[type="submit"] {
-            font-size: 18px;
-            padding: 12px 20px;
-            font-weight: bold;
-            background-color: #4CAF50;
-            color: white;
-            border: none;
-            border-radius: 6px;
-            cursor: pointer;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            transition: background-color 0.3s ease, box-shadow 0.3s ease;
-        }
-
-        .postcode-form input[type="submit"]:hover {
-            background-color: #45a049;
-            box-shadow: 0 6px 10px rgba(0, 0, 0, 0.15);
-        }
-
-        .postcode-form input[type="submit"]:focus {
-            outline: none;
-            box-shadow: 0 0 6px rgba(50, 205, 50, 0.6);
-        }
-
-        .calendar {
-            display: grid;
-            grid-template-columns: repeat(8, 1fr);  /* 8 tiles per row for larger screens */
-            gap: 10px;
-            padding: 20px;
-            max-width: 100%;
-            margin: 0 auto;
-        }
-
-        /* Styling for 1920px screen width */
-        @media (max-width: 1920px) {
-            .calendar {
-                grid-template-columns: repeat(8, 1fr);  /* 8 tiles per row for screens 1920px */
-            }
-        }
-
-        /* Mobile styling */
-        @media (max-width: 768px) {
-            .header {
-                font-size: 28px;
-                padding: 20px;
-            }
-
-            .postcode-form {
-                margin-top: 20px;
-                margin-bottom: 20px;
-            }
-
-            .postcode-form input[type="text"] {
-                width: 70%;
-                margin-bottom: 10px;
-            }
-
-            .postcode-form input[type="submit"] {
-                width: 60%;
-            }
-
-            .calendar {
-                grid-template-columns: repeat(4, 1fr);  /* 4 tiles per row for screens smaller than 768px */
-                padding-left: 5px;  /* Ensure slight padding on left side */
-                padding-right: 5px; /* Ensure slight padding on right side */
-            }
-
-            .tile span.day {
-                font-weight: bold;
-                font-size: 10.5px !important;  /* Change the font size only for mobile */
-            }
-
-            .tile span.time {
-                font-size: 10px !important;  /* Adjust the time font size for mobile */
-            }
-
-            .tile span.percentage {
-                font-size: 12px !important;  /* Adjust percentage size for mobile */
-            }
-        }
-
-        /* Ensure the tile content is centered */
-        .tile {
-            background-color: #ffffff;
-            text-align: center;
-            padding: 15px;
-            border-radius: 8px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.1);
-            display: flex;
-            flex-direction: column;
-            justify-content: space-between;  /* Keep original vertical spacing */
-            align-items: center;             /* Ensure horizontal centering */
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-            font-size: 12px;
-            min-width: 80px;   /* Adjust the width of the tiles */
-            height: 100px;     /* Adjust the height of the tiles */
-        }
-
-        .tile:hover {
-            transform: translateY(-3px);
-            box-shadow: 0 6px 10px rgba(0, 0, 0, 0.12);
-        }
-
-        .tile span.day, .tile span.time, .tile span.percentage {
-            text-align: center;  /* Ensure all text stays centered */
-        }
+# Page for a search, given its outward code (None if the postcode was invalid) and forecast
+def render_search_result(outward_code, combined_data, region_name, stale=False):
+    if outward_code:
+        if combined_data:
+            return render_html_calendar(outward_code, region_name, combined_data, stale)
+        else:
+            return "<p>Sorry, no data is available for this region. Please try again later.</p>"
+    else:
+        return "<p>Invalid postcode. Please try again.</p>"
+
+# Join the template's output into one chunk per flush marker, rather than one
+# tiny write per template node
+def flushed_chunks(chunks):
+    buffer = []
+    for chunk in chunks:
+        if chunk == FLUSH:
+            yield ''.join(buffer)
+            buffer = []
+        else:
+            buffer.append(chunk)
+    yield ''.join(buffer)
+
+# Search result streamed as it renders: the head, header and form go out at
+# once, so the browser can fetch the stylesheets while the forecast is fetched
+def stream_search_result(outward_code, region_name):
+    # The tiles, and whether they come from an earlier forecast
+    def load_tiles():
+        try:
+            with timed_stage('forecast'):
+                combined_data, _, stale = fetch_combined_data(outward_code)
+        except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+            print(f"Failed to fetch data: {e}")
+            return [], False
+        if not combined_data:
+            return [], False
+        with timed_stage('aggregate'):
+            return build_tiles(combined_data), stale
+
+    context = {'postcode': outward_code, 'region_name': region_name, 'load_tiles': load_tiles, 'flush': FLUSH}
+    app.update_template_context(context)
+    chunks = app.jinja_env.get_template('calendar.html').generate(context)
+    return Response(stream_with_context(flushed_chunks(chunks)), mimetype='text/html')
+
+# The landing page is the same for every visitor, so it is rendered and gzipped once
+def build_landing_page():
+    with app.test_request_context():
+        html = render_template('index.html').encode('utf-8')
+    return {
+        'body': html,
+        'gzip': gzip.compress(html, 9),
+        'etag': hashlib.sha1(html).hexdigest()[:16],
+    }
+
+def landing_page_response():
+    if 'gzip' in request.accept_encodings:
+        response = Response(landing_page['gzip'], mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+        response.set_etag(landing_page['etag'] + '-gz')
+    else:
+        response = Response(landing_page['body'], mimetype='text/html')
+        response.set_etag(landing_page['etag'])
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.max_age = 300
+    return response.make_conditional(request)
 
-        footer {
-            text-align: center;
-            margin-top: 10px;
-            padding-bottom: 20px;
-            font-size: 12px;
-            color: #777;
-        }
-    </style>
-</head>
-<body>
-    <h2 class="header">48-Hour Renewable Energy Forecast: {{ region_name }}</h2>
-    <form method="post" class="postcode-form">
-        <input type="text" name="postcode" placeholder="Enter postcode">
-        <input type="submit" value="Check Forecast">
-    </form>
-    <div class="calendar">
-        {% for tile in tiles %}
-            <div class="tile" style="background-color: {{ tile.color }};">
-                <span class="day">{{ tile.date }}</span><br>
-                <span class="time">{{ tile.time }}</span><br>
-                <span class="percentage">{{ tile.percentage }}%</span>
-            </div>
-        {% endfor %}
-    </div>
-    <footer>
-        Data from National Grid ESO, Carbon Intensity API
-    </footer>
-</body>
-</html>
-    '''
-    
-    return render_template_string(calendar_html, tiles=tiles, postcode=postcode, region_name=region_name)
+# Compile the templates at startup rather than on the first search
+app.jinja_env.get_template('calendar.html')
+landing_page = build_landing_page()
 
 # First view page with updated design (without affecting the results page)
 @app.route('/', methods=['GET', 'POST'])
@@ -313,112 +588,292 @@ def index():
             return "<p>Postcode is required. Please enter a valid postcode.</p>"
         
         postcode = request.form['postcode']
-        outward_code = convert_to_outward_code(postcode)
+        try:
+            with timed_stage('postcode'):
+                outward_code = convert_to_outward_code(postcode)
+        except PostcodeLookupUnavailable:
+            return f"<p>{LOOKUP_UNAVAILABLE_MESSAGE}</p>"
         
+        # The header names the region, so only searches whose region is already
+        # known can be streamed
+        if outward_code and STREAM_SEARCH_RESULTS:
+            load_snapshot()
+            region_id = outcode_index.region_for(outward_code)
+            if region_id in REGION_NAMES:
+                return stream_search_result(outward_code, REGION_NAMES[region_id])
+
+        combined_data, region_name, stale = [], None, False
         if outward_code:
-            combined_data, region_name = fetch_combined_data(outward_code)
-            if combined_data:
-                return generate_html_calendar(outward_code, region_name)
-            else:
-                return "<p>Sorry, no data is available for this region. Please try again later.</p>"
-        else:
-            return "<p>Invalid postcode. Please try again.</p>"
+            with timed_stage('forecast'):
+                combined_data, region_name, stale = fetch_combined_data(outward_code)
+        return render_search_result(outward_code, combined_data, region_name, stale)
     
-    # First view page (postcode input page) with reduced white space
-    return '''
-    <html>
-    <head>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <style>
-            * {
-                box-sizing: border-box;
-                margin: 0;
-                padding: 0;
-            }
-
-            body {
-                font-family: 'Arial', sans-serif;
-                background-color: #f7f9fb;
-                color: #333;
-                display: flex;
-                justify-content: center;
-                align-items: center;
-                height: 100vh;
-                flex-direction: column;
-            }
-
-            h1 {
-                font-size: 3em;
-                font-weight: bold;
-                margin-bottom: 20px;
-                text-align: center;
-            }
-
-            form {
-                text-align: center;
-                margin-bottom: 0;  /* Adjust this to control space below the form */
-            }
-
-            input[type="text"] {
-                padding: 15px;
-                font-size: 1.2em;
-                width: 350px;
-                margin-bottom: 20px;
-                border-radius: 8px;
-                border: 1px solid #ddd;
-                box-shadow: 0 2px 8px rgba(0, 0, 0, 0.1);
-                transition: all 0.3s ease;
-            }
-
-            input[type="text"]:focus {
-                outline: none;
-                border: 1px solid #4CAF50;
-                box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
-            }
-
-            input[type="submit"] {
-                padding: 15px 30px;
-                font-size: 1.2em;
-                background-color: #4CAF50;
-                color: white;
-                border: none;
-                border-radius: 8px;
-                cursor: pointer;
-                margin-top: 10px;  /* Adjust the space between input and button */
-                box-shadow: 0 4px 12px rgba(0, 0, 0, 0.1);
-                transition: all 0.3s ease;
-            }
-
-            input[type="submit"]:hover {
-                background-color: #45a049;
-                box-shadow: 0 6px 16px rgba(0, 0, 0, 0.2);
-            }
-
-            /* Mobile styling */
-            @media (max-width: 768px) {
-                h1 {
-                    font-size: 2.5em;
-                }
-
-                input[type="text"] {
-                    width: 80%;  /* Adjust width for mobile devices */
-                }
-
-                input[type="submit"] {
-                    width: 70%;  /* Adjust button size for mobile */
-                }
-            }
-        </style>
-    </head>
-    <body>
-        <h1>48-Hour Renewable Energy Forecast</h1>
-        <form method="post">
-            <input type="text" id="postcode" name="postcode" placeholder="Enter postcode"><br>
-            <input type="submit" value="Check Forecast">
-        </form>
-    </body>
-    </html>
-    '''
+    return landing_page_response()
+
+# Hourly tiles in the form the API returns them
+def api_tiles(forecast, window_start):
+    return [
+        {
+            'from': tile['hour'].strftime(API_TIME_FORMAT),
+            'to': (tile['hour'] + timedelta(hours=1)).strftime(API_TIME_FORMAT),
+            'percentage': tile['percentage'],
+            'color': tile['color'],
+        }
+        for tile in build_tiles(current_rows(forecast, window_start))
+    ]
+
+def forecast_document(postcode, outward_code, forecast, tiles):
+    return {
+        'postcode': postcode,
+        'outcode': outward_code,
+        'regionid': forecast['regionid'],
+        'region': forecast['shortname'],
+        'stale': forecast.get('stale', False),
+        'tiles': tiles,
+    }
+
+# Let clients and CDNs keep a forecast until the next settlement period replaces it
+def cache_until_next_period(response, window_start):
+    expires = window_start + SETTLEMENT_PERIOD
+    response.cache_control.public = True
+    response.cache_control.max_age = max(int((expires - datetime.utcnow()).total_seconds()), 0)
+    return response
+
+# Forecast for one postcode as JSON
+@app.route('/api/forecast/<postcode>')
+def api_forecast(postcode):
+    try:
+        with timed_stage('postcode'):
+            outward_code = convert_to_outward_code(postcode)
+    except PostcodeLookupUnavailable:
+        response = jsonify(error=LOOKUP_UNAVAILABLE_MESSAGE)
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    if not outward_code:
+        return jsonify(error="Invalid postcode"), 400
+
+    window_start = settlement_period_start()
+    with timed_stage('forecast'):
+        forecast = fetch_forecast(outward_code, window_start)
+    if forecast is None:
+        return jsonify(error="No data is available for this region. Please try again later."), 503
+
+    with timed_stage('aggregate'):
+        tiles = api_tiles(forecast, window_start)
+    response = jsonify(forecast_document(postcode, outward_code, forecast, tiles))
+    if forecast.get('stale'):
+        # Only good until the current forecast can be fetched
+        response.cache_control.no_cache = True
+        return response
+    response.add_etag()
+    return cache_until_next_period(response, window_start).make_conditional(request)
+
+# Forecasts for many postcodes, streamed as NDJSON (default) or CSV with ?format=csv.
+# The postcodes are checked once the response has started, and those in the same
+# region share one forecast lookup.
+@app.route('/api/forecast/batch', methods=['POST'])
+def api_forecast_batch():
+    payload = request.get_json(silent=True)
+    postcodes = payload.get('postcodes') if isinstance(payload, dict) else payload
+    if not isinstance(postcodes, list) or not postcodes or not all(isinstance(p, str) for p in postcodes):
+        return jsonify(error='Expected a JSON list of postcodes, or {"postcodes": [...]}'), 400
+    if len(postcodes) > BATCH_MAX_POSTCODES:
+        return jsonify(error=f"At most {BATCH_MAX_POSTCODES} postcodes can be looked up at once"), 400
+
+    as_csv = request.args.get('format') == 'csv' or (
+        'format' not in request.args and request.accept_mimetypes.best == 'text/csv')
+    window_start = settlement_period_start()
+    client = request.remote_addr
+
+    def documents():
+        with timed_stage('postcode'):
+            converted = convert_batch_to_outward_codes(postcodes, client)
+        groups = {}
+        for postcode, outward_code, error in converted:
+            if error:
+                yield {'postcode': postcode, 'error': error}
+                continue
+            region_id = outcode_index.region_for(outward_code)
+            groups.setdefault(region_id or outward_code, []).append((postcode, outward_code))
+        for members in groups.values():
+            forecast = fetch_forecast(members[0][1], window_start)
+            tiles = api_tiles(forecast, window_start) if forecast is not None else None
+            for postcode, outward_code in members:
+                if forecast is None:
+                    yield {'postcode': postcode, 'outcode': outward_code, 'error': "No data is available for this region"}
+                else:
+                    yield forecast_document(postcode, outward_code, forecast, tiles)
+
+    def ndjson():
+        for document in documents():
+            yield json.dumps(document, separators=(',', ':')) + '\n'
+
+    def csv_rows():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, CSV_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        for document in documents():
+            rows = [dict(document, **tile) for tile in document.get('tiles', ())] or [document]
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if as_csv:
+        response = Response(stream_with_context(csv_rows()), mimetype='text/csv')
+    else:
+        response = Response(stream_with_context(ndjson()), mimetype='application/x-ndjson')
+    # The headers go out before the body is known, and it may hold errors or stale forecasts
+    response.cache_control.no_cache = True
+    return response
+
+# Band colours for TILE_COLOR_MODE=class; the URL carries a fingerprint, so it can be cached for good
+@app.route('/palette.css')
+def palette_css():
+    response = Response(palette.stylesheet, mimetype='text/css')
+    response.set_etag(palette.fingerprint)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['SEND_FILE_MAX_AGE_DEFAULT']
+    return response.make_conditional(request)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if SERVER_TIMING and request.headers.get('X-Server-Timing') == '1':
+        g.server_timing = []
+
+# Turn away searches from clients over their rate limit before they reach the upstream APIs
+@app.before_request
+def limit_searches():
+    if rate_limiter is None or request.endpoint not in RATE_LIMITED_ENDPOINTS:
+        return None
+    if request.endpoint == 'index' and request.method != 'POST':
+        return None
+    retry_after = rate_limiter.check(request.remote_addr)
+    if not retry_after:
+        return None
+
+    rate_limited_total.inc(endpoint=request.endpoint)
+    if request.endpoint == 'index':
+        response = Response("<p>Too many searches. Please wait a moment and try again.</p>", status=429, mimetype='text/html')
+    else:
+        response = jsonify(error="Too many requests. Please wait a moment and try again.")
+        response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+@app.after_request
+def record_request(response):
+    started = g.request_started
+    endpoint = request.endpoint or 'unmatched'
+    status = response.status_code
+
+    def record():
+        request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+        responses_total.inc(endpoint=endpoint, status=status)
+
+    # A streamed body is generated after this runs, so it is timed once the server has sent it.
+    # Its Server-Timing header can only hold the stages that ran before the headers went out.
+    if response.is_streamed:
+        response.call_on_close(record)
+    else:
+        record()
+
+    spans = g.get('server_timing')
+    if spans is not None:
+        if not response.is_streamed:
+            spans.append(('total', time.perf_counter() - started))
+        if spans:
+            response.headers['Server-Timing'] = server_timing_header(spans)
+    return response
+
+@metrics.register_collector
+def collect_cache_metrics():
+    stats = forecast_cache.stats()
+    families = [
+        Family(f'forecast_cache_{name}_total', 'counter', help).add(stats[name])
+        for name, help in (
+            ('hits', "Forecast cache lookups answered from memory"),
+            ('misses', "Forecast cache lookups that found nothing current"),
+            ('stale_hits', "Misses answered with the previous settlement period's forecast"),
+            ('coalesced', "Misses that waited on another thread's upstream call"),
+            ('evictions', "Forecasts evicted to make room"),
+            ('expirations', "Forecasts dropped because their settlement period ended"),
+        )
+    ]
+    families.append(Family('forecast_cache_entries', 'gauge', "Forecasts held in memory").add(stats['entries']))
+    families.append(Family('forecast_cache_hit_ratio', 'gauge', "Share of forecast lookups answered from memory")
+                    .add(stats['hit_ratio']))
+    return families
+
+@metrics.register_collector
+def collect_admission_metrics():
+    active_family = Family('upstream_calls_in_flight', 'gauge', "Upstream calls running")
+    waiting_family = Family('upstream_calls_waiting', 'gauge', "Upstream calls queued for a turn")
+    shed_family = Family('upstream_calls_shed_total', 'counter', "Upstream calls not made because too many were in flight")
+    for client, limiter in upstream_limiters.items():
+        stats = limiter.stats()
+        active_family.add(stats['active'], client=client)
+        waiting_family.add(stats['waiting'], client=client)
+        shed_family.add(stats['shed'], client=client)
+    return [active_family, waiting_family, shed_family]
+
+@metrics.register_collector
+def collect_upstream_metrics():
+    requests_family = Family('upstream_requests_total', 'counter', "Upstream calls attempted, by host")
+    responses_family = Family('upstream_responses_total', 'counter', "Upstream responses, by host and status code")
+    failures_family = Family('upstream_failures_total', 'counter', "Upstream calls that failed or returned a retryable status")
+    retries_family = Family('upstream_retries_total', 'counter', "Upstream calls retried")
+    rejected_family = Family('upstream_circuit_rejections_total', 'counter', "Calls refused while a host's circuit was open")
+    open_family = Family('upstream_circuit_open', 'gauge', "1 while a host's circuit breaker is open")
+    latency_family = Family('upstream_request_duration_seconds', 'histogram', "Upstream call latency, by host")
+
+    for client, stats in upstream_stats_sources.items():
+        for host, host_stats in stats().items():
+            requests_family.add(host_stats['requests'], client=client, host=host)
+            failures_family.add(host_stats['failures'], client=client, host=host)
+            retries_family.add(host_stats['retries'], client=client, host=host)
+            rejected_family.add(host_stats['rejected'], client=client, host=host)
+            open_family.add(int(host_stats['circuit'] == 'open'), client=client, host=host)
+            for code, count in host_stats['responses'].items():
+                responses_family.add(count, client=client, host=host, code=code)
+            histogram_samples(latency_family, host_stats['latency_seconds'], client=client, host=host)
+    return [requests_family, responses_family, failures_family, retries_family,
+            rejected_family, open_family, latency_family]
+
+# Directory the worker processes share their metrics through, so a scrape that
+# reaches any one of them reports for all (gunicorn.conf.py sets it). Unset,
+# /metrics reports for the process that answers.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+metrics_store = MultiprocessStore(METRICS_DIR, metrics) if METRICS_DIR else None
+
+# Prometheus metrics for every worker process
+@app.route('/metrics')
+def metrics_endpoint():
+    body = metrics_store.render() if metrics_store else metrics.render()
+    return Response(body, mimetype='text/plain; version=0.0.4')
+
+# Forecast cache counters, for checking how many searches reach the upstream API
+@app.route('/debug/cache')
+def debug_cache():
+    return jsonify(dict(forecast_cache.stats(), prewarmer=prewarmer.stats()))
+
+# Per-host upstream latency histograms and circuit breaker states
+@app.route('/debug/upstream')
+def debug_upstream():
+    return jsonify(upstream.stats())
+
+# Start the optional background threads; gunicorn calls this in each worker after forking
+def start_background_tasks():
+    load_snapshot()
+    if metrics_store:
+        metrics_store.start()
+    if PREWARM_FORECASTS:
+        prewarmer.start()
+
+# Development server only; production runs under gunicorn (see gunicorn.conf.py)
 if __name__ == '__main__':
+    start_background_tasks()
     port = int(os.environ.get("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    app.run(host='0.0.0.0', port=port, debug=os.environ.get("FLASK_DEBUG") == "1")
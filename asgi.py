@@ -0,0 +1,336 @@
+import asyncio
+import os
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import httpx
+import requests
+from asgiref.wsgi import WsgiToAsgi
+
+from admission import AsyncConcurrencyLimiter
+from app import (
+    LOOKUP_UNAVAILABLE_MESSAGE, POSTCODES_API_URL, PROXY_HOPS, UPSTREAM_DEADLINE, UPSTREAM_MAX_QUEUED,
+    UPSTREAM_QUEUE_TIMEOUT, PostcodeLookupUnavailable, app as flask_app, confirmed_outcodes, current_rows,
+    forecast_cache, load_snapshot, outcode_index, parse_postcode_lookup, parse_region_forecast, prewarmer,
+    SERVER_TIMING, rate_limited_total, rate_limiter, region_forecast_url, render_search_result,
+    request_seconds, responses_total, server_timing_header, server_timing_spans, snapshot_writer,
+    stale_forecast, start_background_tasks, timed_stage, unknown_postcodes, upstream_limiters,
+    upstream_stats_sources,
+)
+from forecast_cache import settlement_period_start
+from outcodes import parse_postcode
+from upstream import (
+    RETRYABLE_STATUS_CODES, CircuitBreaker, CircuitOpenError, LatencyHistogram, UpstreamBusyError,
+)
+
+# ASGI entry point. Searches (POST /) run on the event loop, with upstream calls
+# made through a shared httpx.AsyncClient pool, so a worker can keep thousands
+# of them in flight while it waits on the network. Every other route goes to the
+# Flask app through asgiref's WSGI adapter.
+#
+#     uvicorn asgi:app --workers 4
+#     gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+
+MAX_FORM_BYTES = 64 * 1024
+
+# Async counterpart of upstream.UpstreamClient: pooled keep-alive connections,
+# timeouts, and the same per-host circuit breakers, latency histograms and
+# optional concurrency limiter (an admission.AsyncConcurrencyLimiter). A call,
+# counting its wait for a limiter slot, gives up after `deadline` seconds.
+class AsyncUpstreamClient:
+    def __init__(self, connect_timeout=3.05, read_timeout=10, retries=1, pool_size=100,
+                 failure_threshold=5, reset_timeout=30, limiter=None, deadline=12):
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)
+        self.retries = retries
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.limiter = limiter
+        self.deadline = deadline
+        self.client = None
+        self.breakers = {}
+        self.latency = {}
+        self.counts = {}
+
+    async def start(self):
+        if self.client is None:
+            transport = httpx.AsyncHTTPTransport(limits=self.limits, retries=self.retries)
+            self.client = httpx.AsyncClient(timeout=self.timeout, transport=transport)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def get(self, url):
+        await self.start()
+        netloc = urlsplit(url).netloc
+        breaker = self.breakers.get(netloc)
+        if breaker is None:
+            breaker = self.breakers[netloc] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+            self.latency[netloc] = LatencyHistogram()
+            self.counts[netloc] = {'requests': 0, 'failures': 0, 'rejected': 0, 'shed': 0, 'responses': {}}
+        counts = self.counts[netloc]
+        deadline = time.monotonic() + self.deadline
+        if self.limiter is not None and not await self.limiter.acquire(min(self.limiter.timeout, self.deadline)):
+            counts['shed'] += 1
+            raise UpstreamBusyError(f"Too many upstream calls in flight to call {netloc}")
+        try:
+            if not breaker.allow():
+                counts['rejected'] += 1
+                raise CircuitOpenError(f"Circuit open for {netloc}")
+
+            counts['requests'] += 1
+            started = time.perf_counter()
+            try:
+                response = await asyncio.wait_for(self.client.get(url), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                counts['failures'] += 1
+                breaker.record_failure()
+                raise httpx.TimeoutException(f"No answer from {netloc} within {self.deadline}s")
+            except httpx.HTTPError:
+                counts['failures'] += 1
+                breaker.record_failure()
+                raise
+            except BaseException:
+                # Cancelled, or a bug of ours: no verdict on the host either way
+                breaker.abandon()
+                raise
+            finally:
+                self.latency[netloc].observe(time.perf_counter() - started)
+        finally:
+            if self.limiter is not None:
+                self.limiter.release()
+        counts['responses'][response.status_code] = counts['responses'].get(response.status_code, 0) + 1
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            counts['failures'] += 1
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        return response
+
+    # Same shape as UpstreamClient.stats()
+    def stats(self):
+        return {
+            netloc: {
+                'circuit': breaker.state,
+                'requests': self.counts[netloc]['requests'],
+                'failures': self.counts[netloc]['failures'],
+                'retries': 0,
+                'rejected': self.counts[netloc]['rejected'],
+                'shed': self.counts[netloc]['shed'],
+                'responses': {str(code): count for code, count in sorted(self.counts[netloc]['responses'].items())},
+                'latency_seconds': self.latency[netloc].snapshot(),
+            }
+            for netloc, breaker in list(self.breakers.items())
+        }
+
+UPSTREAM_ERRORS = (httpx.HTTPError, requests.exceptions.RequestException, KeyError, ValueError)
+
+ASYNC_UPSTREAM_POOL_SIZE = int(os.environ.get("ASYNC_UPSTREAM_POOL_SIZE", 100))
+ASYNC_UPSTREAM_MAX_CONCURRENT = int(os.environ.get("ASYNC_UPSTREAM_MAX_CONCURRENT", ASYNC_UPSTREAM_POOL_SIZE))
+async_upstream_limiter = AsyncConcurrencyLimiter(
+    ASYNC_UPSTREAM_MAX_CONCURRENT, UPSTREAM_MAX_QUEUED, UPSTREAM_QUEUE_TIMEOUT) if ASYNC_UPSTREAM_MAX_CONCURRENT > 0 else None
+
+async_upstream = AsyncUpstreamClient(
+    connect_timeout=float(os.environ.get("UPSTREAM_CONNECT_TIMEOUT", 3.05)),
+    read_timeout=float(os.environ.get("UPSTREAM_READ_TIMEOUT", 10)),
+    pool_size=ASYNC_UPSTREAM_POOL_SIZE,
+    limiter=async_upstream_limiter,
+    deadline=UPSTREAM_DEADLINE,
+)
+upstream_stats_sources['async'] = async_upstream.stats
+if async_upstream_limiter:
+    upstream_limiters['async'] = async_upstream_limiter
+
+# Upstream calls currently running on this worker's event loop, so concurrent
+# searches for the same thing share one call
+_inflight = {}
+
+def single_flight(key, make_coroutine):
+    task = _inflight.get(key)
+    if task is None:
+        task = _inflight[key] = asyncio.ensure_future(make_coroutine())
+        task.add_done_callback(lambda t: _inflight.pop(key, None))
+    # Shield the shared call from any one caller being cancelled
+    return asyncio.shield(task)
+
+async def fetch_region_forecast_async(path, window_start):
+    response = await async_upstream.get(region_forecast_url(path, window_start))
+    response.raise_for_status()
+    return parse_region_forecast(response.json())
+
+async def lookup_outward_code_async(postcode):
+    try:
+        response = await async_upstream.get(f"{POSTCODES_API_URL}/postcodes/{postcode}")
+    except UPSTREAM_ERRORS as e:
+        print(f"Failed to look up postcode: {e}")
+        raise PostcodeLookupUnavailable(str(e)) from e
+    if response.status_code == 200:
+        return parse_postcode_lookup(response.json())
+    if response.status_code == 404:
+        unknown_postcodes.add(postcode)
+    return None
+
+async def region_forecast(region_id, window_start):
+    forecast = forecast_cache.get(region_id, window_start)
+    if forecast is None and prewarmer.running:
+        forecast = forecast_cache.get_stale(region_id)
+    if forecast is not None:
+        return forecast
+
+    async def load():
+        forecast = await fetch_region_forecast_async(f"/regionid/{region_id}", window_start)
+        forecast_cache.put(region_id, window_start, forecast)
+        return forecast
+    return await single_flight((region_id, window_start), load)
+
+async def postcode_forecast(outward_code, window_start):
+    async def load():
+        forecast = await fetch_region_forecast_async(f"/postcode/{outward_code}", window_start)
+        if forecast['regionid'] is not None:
+            outcode_index.learn(outward_code, forecast['regionid'])
+            forecast_cache.put(forecast['regionid'], window_start, forecast)
+        return forecast
+    return await single_flight(('postcode', outward_code, window_start), load)
+
+# Templates use url_for, so they need a request context even outside Flask's own routes
+def render(outward_code, combined_data, region_name, stale=False):
+    with flask_app.test_request_context('/', method='POST'):
+        return render_search_result(outward_code, combined_data, region_name, stale)
+
+# Async version of the POST branch of app.index()
+async def search(postcode):
+    load_snapshot()
+    parsed = parse_postcode(postcode)
+    if parsed is None:
+        return render(None, [], None)
+    outward_code = parsed[0]
+    normalised = ' '.join(parsed)
+    window_start = settlement_period_start()
+    region_id = outcode_index.region_for(outward_code)
+    if region_id is None and outward_code not in confirmed_outcodes and normalised in unknown_postcodes:
+        return render(None, [], None)
+
+    forecast_task = None
+    try:
+        if region_id is not None:
+            with timed_stage('forecast'):
+                forecast = await region_forecast(region_id, window_start)
+        else:
+            # Start on the forecast while Postcodes.io checks the postcode, instead of after
+            forecast_task = asyncio.ensure_future(postcode_forecast(outward_code, window_start))
+            if outward_code not in confirmed_outcodes:
+                try:
+                    with timed_stage('postcode'):
+                        confirmed = await single_flight(('lookup', normalised), lambda: lookup_outward_code_async(normalised))
+                except PostcodeLookupUnavailable:
+                    return f"<p>{LOOKUP_UNAVAILABLE_MESSAGE}</p>"
+                if confirmed is None:
+                    return render(None, [], None)
+                confirmed_outcodes.add(outward_code)
+            with timed_stage('forecast'):
+                forecast = await forecast_task
+    except UPSTREAM_ERRORS as e:
+        print(f"Failed to fetch data: {e}")
+        forecast = stale_forecast(region_id)
+    finally:
+        # A speculative fetch we no longer need still fills the cache; just don't leave its error unread
+        if forecast_task is not None and not forecast_task.done():
+            forecast_task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    if forecast is None:
+        return render(outward_code, [], None)
+    return render(outward_code, current_rows(forecast, window_start), forecast['shortname'], forecast.get('stale', False))
+
+# The client's address, taken from X-Forwarded-For behind PROXY_HOPS proxies as ProxyFix does
+def client_address(scope):
+    if PROXY_HOPS:
+        for name, value in scope.get('headers', ()):
+            if name == b'x-forwarded-for':
+                forwarded = [address.strip() for address in value.decode('latin-1').split(',')]
+                if len(forwarded) >= PROXY_HOPS:
+                    return forwarded[-PROXY_HOPS]
+                break
+    client = scope.get('client')
+    return client[0] if client else None
+
+class SearchApp:
+    def __init__(self, wsgi_app):
+        self.wsgi = WsgiToAsgi(wsgi_app)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http' and scope['method'] == 'POST' and scope['path'] == '/':
+            await self.search(scope, receive, send)
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await async_upstream.start()
+                start_background_tasks()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await async_upstream.close()
+                if snapshot_writer:
+                    await asyncio.get_running_loop().run_in_executor(None, snapshot_writer.flush, 5)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def search(self, scope, receive, send):
+        started = time.perf_counter()
+        spans = [] if SERVER_TIMING and (b'x-server-timing', b'1') in scope['headers'] else None
+        headers = []
+        retry_after = rate_limiter.check(client_address(scope)) if rate_limiter is not None else 0
+        if retry_after:
+            rate_limited_total.inc(endpoint='index')
+            status, html = 429, "<p>Too many searches. Please wait a moment and try again.</p>"
+            headers.append((b'retry-after', str(retry_after).encode('ascii')))
+        else:
+            token = server_timing_spans.set(spans)
+            try:
+                status, html = await self.handle_search(receive)
+            finally:
+                server_timing_spans.reset(token)
+        if spans is not None:
+            spans.append(('total', time.perf_counter() - started))
+            headers.append((b'server-timing', server_timing_header(spans).encode('ascii')))
+        await self.respond(send, status, html, headers)
+        request_seconds.observe(time.perf_counter() - started, endpoint='index')
+        responses_total.inc(endpoint='index', status=status)
+
+    # The status and page for a search
+    async def handle_search(self, receive):
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+            if len(body) > MAX_FORM_BYTES:
+                return 413, "<p>Request too large.</p>"
+
+        form = parse_qs(body.decode('utf-8', 'replace'))
+        postcode = form.get('postcode', [''])[0]
+        if not postcode:
+            return 200, "<p>Postcode is required. Please enter a valid postcode.</p>"
+        return 200, await search(postcode)
+
+    async def respond(self, send, status, html, headers=()):
+        payload = html.encode('utf-8')
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'text/html; charset=utf-8'),
+                (b'content-length', str(len(payload)).encode('ascii')),
+                *headers,
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': payload})
+
+app = SearchApp(flask_app)
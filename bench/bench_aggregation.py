@@ -0,0 +1,79 @@
+# Micro-benchmark of group_data_by_hour against the implementation it replaced,
+# over a batch of synthetic 48-hour forecasts for every region.
+#
+#     python bench/bench_aggregation.py [--regions 14] [--repeat 5] [--number 20]
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aggregation import aggregate_generation_mix  # noqa: E402
+
+FUELS = ('biomass', 'coal', 'imports', 'gas', 'nuclear', 'other', 'hydro', 'solar', 'wind')
+
+# The strptime / three-scan version of group_data_by_hour, kept as the baseline
+def legacy_group_data_by_hour(combined_data):
+    hourly_data = {}
+    for entry in combined_data:
+        timestamp = datetime.strptime(entry['from'], "%Y-%m-%dT%H:%MZ")
+        hour = timestamp.replace(minute=0)
+        wind_perc = next((item['perc'] for item in entry['generationmix'] if item['fuel'] == 'wind'), 0)
+        solar_perc = next((item['perc'] for item in entry['generationmix'] if item['fuel'] == 'solar'), 0)
+        hydro_perc = next((item['perc'] for item in entry['generationmix'] if item['fuel'] == 'hydro'), 0)
+        combined_renewable_perc = wind_perc + solar_perc + hydro_perc
+        if hour not in hourly_data:
+            hourly_data[hour] = {'count': 0, 'total_renewable_perc': 0}
+        hourly_data[hour]['count'] += 1
+        hourly_data[hour]['total_renewable_perc'] += combined_renewable_perc
+    for hour in hourly_data:
+        hourly_data[hour]['average_renewable_perc'] = round(hourly_data[hour]['total_renewable_perc'] / hourly_data[hour]['count'])
+    return hourly_data
+
+def synthetic_forecast(seed, start, periods=96):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(periods):
+        period_start = start + timedelta(minutes=30 * i)
+        shares = [rng.random() for _ in FUELS]
+        scale = 100 / sum(shares)
+        rows.append({
+            'from': period_start.strftime("%Y-%m-%dT%H:%MZ"),
+            'to': (period_start + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%MZ"),
+            'intensity': {'forecast': rng.randint(20, 300), 'index': 'moderate'},
+            'generationmix': [{'fuel': fuel, 'perc': round(share * scale, 1)} for fuel, share in zip(FUELS, shares)],
+        })
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--regions', type=int, default=14)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=20)
+    args = parser.parse_args()
+
+    start = datetime(2024, 1, 1, 0, 0)
+    batch = [synthetic_forecast(region, start) for region in range(args.regions)]
+
+    for rows in batch:
+        legacy = legacy_group_data_by_hour(rows)
+        current = aggregate_generation_mix(rows)
+        assert list(legacy) == list(current)
+        for hour in legacy:
+            assert legacy[hour]['average_renewable_perc'] == current[hour]['average_renewable_perc']
+
+    def run(fn):
+        return lambda: [fn(rows) for rows in batch]
+
+    results = {}
+    for name, fn in (('legacy', legacy_group_data_by_hour), ('aggregate_generation_mix', aggregate_generation_mix)):
+        best = min(timeit.repeat(run(fn), repeat=args.repeat, number=args.number)) / args.number
+        results[name] = best
+        print(f"{name:>26}: {best * 1000:8.3f} ms per batch of {args.regions} regions")
+    print(f"{'speed-up':>26}: {results['legacy'] / results['aggregate_generation_mix']:8.2f}x")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# Latency under load of the threaded (gunicorn, app:app) and async (uvicorn,
+# asgi:app) search paths, against a stub upstream that adds a fixed latency to
+# every call. The forecast cache is disabled so every search waits on the network.
+#
+#     python bench/bench_async.py --latency 100 --concurrency 16,64,256 --duration 10
+import argparse
+
+from loadtest import run_load, start_gunicorn, start_uvicorn
+from stub_server import start_stub_server
+
+NO_CACHE = {'FORECAST_CACHE_SIZE': '0'}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency', type=float, default=100, help='stub upstream latency in milliseconds')
+    parser.add_argument('--concurrency', default='16,64,256', help='comma separated concurrent client counts')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument('--threads', type=int, default=4, help='threads of the single gunicorn worker')
+    args = parser.parse_args()
+
+    stub = start_stub_server(latency=args.latency / 1000)
+    modes = (
+        ('threaded', lambda: start_gunicorn(1, args.threads, stub.url, NO_CACHE)),
+        ('async', lambda: start_uvicorn(1, stub.url, NO_CACHE)),
+    )
+    for name, start in modes:
+        process, url = start()
+        try:
+            for concurrency in [int(c) for c in args.concurrency.split(',')]:
+                result = run_load(url, concurrency, args.duration)
+                print(f"{name:>8} concurrency={concurrency:<4} {result}")
+        finally:
+            process.terminate()
+            process.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,162 @@
+# Throughput of the search page under gunicorn for different worker counts,
+# against the local stub upstream.
+#
+#     python bench/loadtest.py --workers 1,2,4 --threads 4 --concurrency 32 --duration 10
+#     python bench/loadtest.py --url http://127.0.0.1:5000   # an already running server
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from stub_server import start_stub_server
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+POSTCODES = ['RG1 1AA', 'M1 1AE', 'EC1A 1BB', 'LS1 4AP', 'CF10 1EP', 'NE1 7RU', 'B1 1BB', 'EH1 1YZ']
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+# Hammer `url` from `concurrency` threads for `duration` seconds
+def run_load(url, concurrency, duration, method='POST', postcodes=POSTCODES):
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def client(n):
+        nonlocal errors
+        session = requests.Session()
+        mine = []
+        failed = 0
+        i = n
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                if method == 'POST':
+                    response = session.post(url, data={'postcode': postcodes[i % len(postcodes)]}, timeout=30)
+                else:
+                    response = session.get(url, timeout=30)
+                if response.status_code >= 400:
+                    failed += 1
+            except requests.exceptions.RequestException:
+                failed += 1
+            mine.append(time.perf_counter() - started)
+            i += 1
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return summarise(latencies, errors, elapsed)
+
+def summarise(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+def wait_until_up(url, timeout=20):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.1)
+    raise RuntimeError(f"Server at {url} did not start")
+
+# Run the app under gunicorn with the given worker count, pointed at `upstream_url`
+def start_gunicorn(workers, threads, upstream_url, extra_env=None):
+    port = free_port()
+    env = dict(
+        os.environ,
+        PORT=str(port),
+        WEB_CONCURRENCY=str(workers),
+        GUNICORN_THREADS=str(threads),
+        GUNICORN_ACCESS_LOG='/dev/null',
+        POSTCODES_API_URL=upstream_url,
+        CARBON_INTENSITY_API_URL=upstream_url,
+        SEARCH_RATE_LIMIT='0',  # every load test client shares one address
+        FORECAST_SNAPSHOT_PATH='',  # keep the stub's forecasts out of any real snapshot
+    )
+    env.update(extra_env or {})
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', 'app:app'], cwd=ROOT, env=env)
+    return wait_for_process(process, f"http://127.0.0.1:{port}/")
+
+# Run the ASGI entry point under uvicorn, pointed at `upstream_url`
+def start_uvicorn(workers, upstream_url, extra_env=None):
+    port = free_port()
+    env = dict(
+        os.environ,
+        POSTCODES_API_URL=upstream_url,
+        CARBON_INTENSITY_API_URL=upstream_url,
+        SEARCH_RATE_LIMIT='0',  # every load test client shares one address
+        FORECAST_SNAPSHOT_PATH='',  # keep the stub's forecasts out of any real snapshot
+    )
+    env.update(extra_env or {})
+    command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--port', str(port),
+               '--workers', str(workers), '--log-level', 'warning', '--no-access-log']
+    process = subprocess.Popen(command, cwd=ROOT, env=env)
+    return wait_for_process(process, f"http://127.0.0.1:{port}/")
+
+def wait_for_process(process, url):
+    try:
+        wait_until_up(url)
+    except RuntimeError:
+        process.terminate()
+        raise
+    return process, url
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4', help='comma separated gunicorn worker counts')
+    parser.add_argument('--threads', type=int, default=4, help='threads per worker')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per run')
+    parser.add_argument('--latency', type=float, default=50, help='stub upstream latency in milliseconds')
+    parser.add_argument('--url', help='load an already running server instead of starting gunicorn')
+    args = parser.parse_args()
+
+    if args.url:
+        print(run_load(args.url, args.concurrency, args.duration))
+        return
+
+    stub = start_stub_server(latency=args.latency / 1000)
+    for workers in [int(w) for w in args.workers.split(',')]:
+        process, url = start_gunicorn(workers, args.threads, stub.url)
+        try:
+            run_load(url, args.concurrency, 1)  # warm the caches
+            result = run_load(url, args.concurrency, args.duration)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"workers={workers} threads={args.threads}: {result}")
+
+if __name__ == '__main__':
+    main()
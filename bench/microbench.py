@@ -0,0 +1,80 @@
+# Micro-benchmarks of the search hot path on the fixtures:
+# group_data_by_hour, create_tile_color and generate_html_calendar (with the
+# forecast already cached, so only aggregation and rendering are measured).
+#
+#     python bench/microbench.py [--repeat 5] [--output micro.json]
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+from datetime import datetime
+
+os.environ.setdefault('FORECAST_SNAPSHOT_PATH', '')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402
+from forecast_cache import settlement_period_start  # noqa: E402
+from stub_server import Fixtures  # noqa: E402
+
+# Time `fn` and return the best of `repeat` runs, per call
+def measure(fn, repeat, number=None):
+    timer = timeit.Timer(fn)
+    if number is None:
+        number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number)) / number
+    return {'best_us': round(best * 1e6, 3), 'ops_per_second': round(1 / best, 1), 'loops': number}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    fixtures = Fixtures()
+    window_start = settlement_period_start()
+    forecasts = {
+        region_id: json.loads(fixtures.forecast(window_start, region_id))['data']
+        for region_id in app.REGION_NAMES
+    }
+    for region_id, forecast in forecasts.items():
+        app.forecast_cache.put(region_id, window_start, forecast, notify=False)
+    batch = [forecast['data'] for forecast in forecasts.values()]
+
+    def aggregate_batch():
+        for rows in batch:
+            app.group_data_by_hour(rows)
+
+    def colour_every_percentage():
+        for percentage in range(101):
+            app.create_tile_color(percentage)
+
+    def generate_calendar():
+        app.generate_html_calendar('RG1', 'South England')
+
+    results = {}
+    with app.app.test_request_context('/', method='POST'):
+        for name, fn in (
+            (f'group_data_by_hour x{len(batch)} regions', aggregate_batch),
+            ('create_tile_color x101', colour_every_percentage),
+            ('generate_html_calendar (cached forecast)', generate_calendar),
+        ):
+            results[name] = measure(fn, args.repeat)
+            print(f"{name:>44}: {results[name]['best_us']:10.1f} us")
+
+    report = {
+        'kind': 'microbench',
+        'recorded_at': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'python': platform.python_version(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# Writes the upstream fixtures that bench/stub_server.py replays.
+#
+#     python bench/record_fixtures.py --live   # record today's answers from the real APIs
+#     python bench/record_fixtures.py          # offline: generate answers of the same shape
+#
+# The fixtures checked in are the offline, synthetic ones: plausible numbers,
+# not anything the real APIs said. Run with --live to replace them.
+#
+# The Carbon Intensity fixture is one all-regions fw48h response; the stub
+# derives the per-region and per-postcode answers from it and shifts its
+# timestamps to whatever start time is asked for.
+import argparse
+import gzip
+import json
+import math
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from forecast_cache import settlement_period_start  # noqa: E402
+from outcodes import REGION_NAMES  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+FORECAST_FIXTURE = os.path.join(FIXTURES, 'carbon_intensity_fw48h.json.gz')
+POSTCODES_FIXTURE = os.path.join(FIXTURES, 'postcodes.json')
+
+# One or two postcodes per region, used by the load scenarios. The last few are
+# in areas data/outcode_regions.txt leaves out, so their first search in a
+# scenario goes through Postcodes.io and the region is learned at runtime.
+SAMPLE_POSTCODES = [
+    'AB10 1AB', 'IV2 3HH', 'EH1 1YZ', 'G2 1DY', 'M1 1AE', 'PR1 2HE', 'NE1 7RU', 'SR1 3SD',
+    'LS1 4AP', 'YO1 7HH', 'L1 8JQ', 'LL57 2DG', 'CF10 1EP', 'SA1 3SN', 'B1 1BB', 'CV1 5FB',
+    'NG1 5FS', 'LE1 5WW', 'NR2 1NH', 'CB2 1TN', 'EX1 1HS', 'BS1 5TR', 'RG1 1JX', 'SO14 7DU',
+    'SW1A 1AA', 'EC1A 1BB', 'BN1 1UB', 'CT1 2EH',
+    'SK1 1EB', 'GL1 2EH', 'CR0 1NX', 'KT1 1EU',
+]
+
+CI_REGIONS = {**REGION_NAMES, 15: 'England', 16: 'Scotland', 17: 'Wales', 18: 'GB'}
+OTHER_FUELS = ('biomass', 'coal', 'imports', 'gas', 'nuclear', 'other')
+
+def record_live():
+    start = settlement_period_start().strftime("%Y-%m-%dT%H:%MZ")
+    response = requests.get(f"https://api.carbonintensity.org.uk/regional/intensity/{start}/fw48h", timeout=30)
+    response.raise_for_status()
+    forecast = response.json()
+
+    postcodes = {}
+    for postcode in SAMPLE_POSTCODES:
+        response = requests.get(f"https://api.postcodes.io/postcodes/{postcode}", timeout=30)
+        postcodes[postcode] = response.json()
+    return forecast, postcodes
+
+# Wind that drifts over a couple of days, daytime solar and some hydro in Scotland and Wales
+def synthetic_mix(rng, region_id, moment):
+    hour = moment.hour + moment.minute / 60
+    wind = max(0.0, 25 + 20 * math.sin(((moment - datetime(2024, 1, 1)).total_seconds() / 3600 + region_id * 7) / 9) + rng.uniform(-4, 4))
+    solar = max(0.0, 18 * math.sin(math.pi * (hour - 6) / 12)) * (1 - region_id / 30)
+    hydro = rng.uniform(3, 9) if region_id in (1, 2, 6, 7, 16, 17) else rng.uniform(0, 1)
+    other = [rng.random() for _ in OTHER_FUELS]
+    scale = max(0.0, 100 - wind - solar - hydro) / sum(other)
+    shares = dict(zip(OTHER_FUELS, (share * scale for share in other)), hydro=hydro, solar=solar, wind=wind)
+    return [{'fuel': fuel, 'perc': round(perc, 1)} for fuel, perc in shares.items()]
+
+def record_synthetic():
+    rng = random.Random(2024)
+    start = datetime(2024, 6, 1, 12, 0)
+    periods = []
+    for i in range(96):
+        period_start = start + timedelta(minutes=30 * i)
+        regions = []
+        for region_id, shortname in CI_REGIONS.items():
+            regions.append({
+                'regionid': region_id,
+                'dnoregion': shortname,
+                'shortname': shortname,
+                'intensity': {'forecast': rng.randint(20, 300), 'index': 'moderate'},
+                'generationmix': synthetic_mix(rng, region_id, period_start),
+            })
+        periods.append({
+            'from': period_start.strftime("%Y-%m-%dT%H:%MZ"),
+            'to': (period_start + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%MZ"),
+            'regions': regions,
+        })
+
+    postcodes = {}
+    for postcode in SAMPLE_POSTCODES:
+        outcode, incode = postcode.split()
+        postcodes[postcode] = {'status': 200, 'result': {'postcode': postcode, 'outcode': outcode, 'incode': incode}}
+    return {'data': periods}, postcodes
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--live', action='store_true', help='record from the real APIs')
+    args = parser.parse_args()
+
+    forecast, postcodes = record_live() if args.live else record_synthetic()
+    os.makedirs(FIXTURES, exist_ok=True)
+    with gzip.open(FORECAST_FIXTURE, 'wt', encoding='utf-8') as f:
+        json.dump(forecast, f, separators=(',', ':'))
+    with open(POSTCODES_FIXTURE, 'w') as f:
+        json.dump(postcodes, f, indent=1, sort_keys=True)
+        f.write('\n')
+    print(f"Wrote {FORECAST_FIXTURE} and {POSTCODES_FIXTURE}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+# End-to-end load scenarios against a fresh server and the fixture-replaying
+# stub upstream, reported as throughput, p50/p95/p99 and the number of calls
+# that reached the stub:
+#
+#   cold  - empty cache and snapshot, load starts as soon as the server is up
+#   hot   - every sample postcode searched once before the load starts
+#   herd  - the snapshot holds the previous half hour's forecasts, so they are
+#           all stale and a synchronised burst of clients arrives at once, as
+#           happens on the half-hour mark
+#
+#     python bench/scenarios.py --mode threaded --latency 50 --jitter 20 --error-rate 0.01 --output run.json
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import requests
+
+from loadtest import run_load, start_gunicorn, start_uvicorn, summarise
+from record_fixtures import SAMPLE_POSTCODES
+from stub_server import start_stub_server
+
+from forecast_cache import SETTLEMENT_PERIOD, settlement_period_start  # noqa: E402
+from outcodes import REGION_NAMES  # noqa: E402
+from snapshot_store import SnapshotStore  # noqa: E402
+
+SCENARIOS = ('cold', 'hot', 'herd')
+
+# Fill a new snapshot at `path` with every region's forecast from the previous period
+def seed_stale_snapshot(path, fixtures):
+    previous_start = settlement_period_start() - SETTLEMENT_PERIOD
+    store = SnapshotStore(path)
+    for region_id in REGION_NAMES:
+        forecast = json.loads(fixtures.forecast(previous_start, region_id))['data']
+        store.save_forecast(previous_start, forecast)
+
+# One request from each of `concurrency` clients, released together
+def run_burst(url, concurrency, postcodes):
+    barrier = threading.Barrier(concurrency)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def client(n):
+        nonlocal errors
+        session = requests.Session()
+        barrier.wait()
+        started = time.perf_counter()
+        try:
+            failed = session.post(url, data={'postcode': postcodes[n % len(postcodes)]}, timeout=30).status_code >= 400
+        except requests.exceptions.RequestException:
+            failed = True
+        latency = time.perf_counter() - started
+        with lock:
+            latencies.append(latency)
+            errors += failed
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return summarise(latencies, errors, time.perf_counter() - started)
+
+def run_scenario(name, args, stub):
+    workdir = tempfile.mkdtemp(prefix='bench-')
+    snapshot_path = os.path.join(workdir, 'snapshot.sqlite3')
+    if name == 'herd':
+        seed_stale_snapshot(snapshot_path, stub.fixtures)
+
+    env = {'FORECAST_SNAPSHOT_PATH': snapshot_path}
+    if args.mode == 'async':
+        process, url = start_uvicorn(args.workers, stub.url, env)
+    else:
+        process, url = start_gunicorn(args.workers, args.threads, stub.url, env)
+    try:
+        if name == 'hot':
+            for postcode in SAMPLE_POSTCODES:
+                requests.post(url, data={'postcode': postcode}, timeout=30)
+        stub.reset_counts()
+        if name == 'herd':
+            result = run_burst(url, args.concurrency, SAMPLE_POSTCODES)
+        else:
+            result = run_load(url, args.concurrency, args.duration, postcodes=SAMPLE_POSTCODES)
+        result['upstream_requests'] = dict(stub.requests)
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mode', choices=('threaded', 'async'), default='threaded',
+                        help='gunicorn app:app or uvicorn asgi:app')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated subset of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--threads', type=int, default=4, help='threads per gunicorn worker')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=10, help='seconds per cold or hot run')
+    parser.add_argument('--latency', type=float, default=50, help='stub upstream latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many extra milliseconds, at random')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of stub responses replaced by a 503')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    stub = start_stub_server(latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate)
+    results = {}
+    for name in args.scenarios.split(','):
+        if name not in SCENARIOS:
+            parser.error(f"unknown scenario {name!r}")
+        results[name] = run_scenario(name, args, stub)
+        print(f"{name:>5}: {results[name]}")
+
+    report = {
+        'kind': 'scenarios',
+        'recorded_at': datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'python': platform.python_version(),
+        'settings': {key: value for key, value in vars(args).items() if key not in ('output', 'scenarios')},
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+# Local stand-in for api.postcodes.io and api.carbonintensity.org.uk, so the
+# app can be exercised without touching the real services. It replays the
+# responses in bench/fixtures (see record_fixtures.py), shifted to whatever
+# start time is asked for, with optional latency and error injection. The
+# fixtures checked in are synthetic until record_fixtures.py --live is run.
+#
+#     python bench/stub_server.py --port 8001 --latency 50 --jitter 20 --error-rate 0.05
+#     POSTCODES_API_URL=http://127.0.0.1:8001 CARBON_INTENSITY_API_URL=http://127.0.0.1:8001 gunicorn app:app
+import argparse
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from outcodes import OutcodeIndex  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+POSTCODE_PATH = re.compile(r'^/postcodes/(?P<postcode>[^/]+)$')
+FORECAST_PATH = re.compile(r'^/regional/intensity/(?P<start>[^/]+)/fw48h(?:/(?P<kind>postcode|regionid)/(?P<key>[^/]+))?$')
+
+TIME_FORMAT = "%Y-%m-%dT%H:%MZ"
+
+def parse_start(value):
+    start = datetime.strptime(value, TIME_FORMAT)
+    return start.replace(minute=0 if start.minute < 30 else 30)
+
+# The fixture answers, reshaped for replay
+class Fixtures:
+    def __init__(self, path=FIXTURES):
+        with gzip.open(os.path.join(path, 'carbon_intensity_fw48h.json.gz'), 'rt', encoding='utf-8') as f:
+            periods = json.load(f)['data']
+        with open(os.path.join(path, 'postcodes.json')) as f:
+            self.postcodes = json.load(f)
+
+        # Per region: shortname and the (intensity, generationmix) of each period
+        self.regions = {}
+        for period in periods:
+            for region in period['regions']:
+                entry = self.regions.setdefault(region['regionid'], {
+                    'regionid': region['regionid'],
+                    'dnoregion': region.get('dnoregion'),
+                    'shortname': region.get('shortname'),
+                    'periods': [],
+                })
+                entry['periods'].append((region.get('intensity'), region['generationmix']))
+        self.outcodes = OutcodeIndex.load()
+        self._rendered = {}
+        self._lock = threading.Lock()
+
+    def region_for_outcode(self, outcode):
+        region_id = self.outcodes.region_for(outcode)
+        return region_id if region_id is not None else sum(map(ord, outcode)) % 14 + 1
+
+    def postcode(self, postcode):
+        normalised = ' '.join(postcode.upper().split())
+        recorded = self.postcodes.get(normalised)
+        if recorded is not None:
+            return recorded
+        outcode, _, incode = normalised.partition(' ')
+        return {'status': 200, 'result': {'postcode': normalised, 'outcode': outcode, 'incode': incode}}
+
+    # The fixture forecast re-timed to start at `start`, serialised once per start and shape
+    def forecast(self, start, region_id=None):
+        key = (start, region_id)
+        body = self._rendered.get(key)
+        if body is not None:
+            return body
+
+        times = [(start + timedelta(minutes=30 * i)).strftime(TIME_FORMAT) for i in range(97)]
+        if region_id is None:
+            count = min(len(region['periods']) for region in self.regions.values())
+            payload = {'data': [
+                {'from': times[i], 'to': times[i + 1], 'regions': [
+                    {'regionid': region['regionid'], 'dnoregion': region['dnoregion'], 'shortname': region['shortname'],
+                     'intensity': region['periods'][i][0], 'generationmix': region['periods'][i][1]}
+                    for region in self.regions.values()
+                ]}
+                for i in range(count)
+            ]}
+        else:
+            region = self.regions[region_id]
+            payload = {'data': {
+                'regionid': region['regionid'],
+                'dnoregion': region['dnoregion'],
+                'shortname': region['shortname'],
+                'data': [
+                    {'from': times[i], 'to': times[i + 1], 'intensity': intensity, 'generationmix': mix}
+                    for i, (intensity, mix) in enumerate(region['periods'])
+                ],
+            }}
+        body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            self._rendered[key] = body
+        return body
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.replace('%20', ' ')
+        self.respond('postcodes' if path.startswith('/postcodes/') else 'forecast', lambda: self.route(path))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.respond('postcodes', lambda: self.route_bulk(body))
+
+    def respond(self, kind, route):
+        server = self.server
+        server.count(kind)
+
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if server.error_rate and random.random() < server.error_rate:
+            server.count(kind + '_errors')
+            status, body = 503, b'{"error":{"code":"503 Service Unavailable","message":"Injected error"}}'
+        else:
+            status, body = route()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def route(self, path):
+        fixtures = self.server.fixtures
+
+        match = POSTCODE_PATH.match(path)
+        if match:
+            return 200, json.dumps(fixtures.postcode(match.group('postcode'))).encode('utf-8')
+
+        match = FORECAST_PATH.match(path)
+        if match:
+            start = parse_start(match.group('start'))
+            if match.group('kind') is None:
+                return 200, fixtures.forecast(start)
+            if match.group('kind') == 'postcode':
+                region_id = fixtures.region_for_outcode(match.group('key').upper())
+            else:
+                region_id = int(match.group('key'))
+            if region_id not in fixtures.regions:
+                return 400, b'{"error":{"code":"400 Bad Request","message":"Invalid region"}}'
+            return 200, fixtures.forecast(start, region_id)
+
+        return 404, b'{"status":404,"error":"Not found"}'
+
+    # Postcodes.io's bulk lookup
+    def route_bulk(self, body):
+        if self.path != '/postcodes':
+            return 404, b'{"status":404,"error":"Not found"}'
+        fixtures = self.server.fixtures
+        result = [{'query': postcode, 'result': fixtures.postcode(postcode)['result']}
+                  for postcode in json.loads(body)['postcodes']]
+        return 200, json.dumps({'status': 200, 'result': result}).encode('utf-8')
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.0, jitter=0.0, error_rate=0.0, fixtures=None):
+        super().__init__(address, StubHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.fixtures = fixtures or Fixtures()
+        self.requests = {}
+        self._lock = threading.Lock()
+
+    def count(self, kind):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests = {}
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+# Start a stub server on a background thread; port 0 picks a free port.
+# Latency and jitter are in seconds.
+def start_stub_server(port=0, latency=0.0, jitter=0.0, error_rate=0.0):
+    server = StubServer(('127.0.0.1', port), latency, jitter, error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8001)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0, help='up to this many extra milliseconds, at random')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of responses replaced by a 503')
+    args = parser.parse_args()
+
+    server = StubServer(('127.0.0.1', args.port), args.latency / 1000, args.jitter / 1000, args.error_rate)
+    print(f"Stub upstream listening on {server.url}")
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+SETTLEMENT_PERIOD = timedelta(minutes=30)
+
+# Start of the half-hour settlement period containing the given (naive UTC) time
+def settlement_period_start(moment=None):
+    moment = moment or datetime.utcnow()
+    minute = 0 if moment.minute < 30 else 30
+    return moment.replace(minute=minute, second=0, microsecond=0)
+
+# A load that other threads asking for the same key can wait on
+class _InFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+# LRU cache of regional forecasts keyed by (region id, settlement period start).
+# Entries expire when the next settlement period starts, and concurrent misses
+# for the same key share a single upstream call.
+class ForecastCache:
+    def __init__(self, max_entries=64, clock=datetime.utcnow, on_store=None):
+        self.max_entries = max_entries
+        self.clock = clock
+        # Called with (window start, forecast) whenever a new forecast is stored
+        self.on_store = on_store
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._latest = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.coalesced = 0
+        self.stale_hits = 0
+
+    def get(self, region_id, window_start):
+        key = (region_id, window_start)
+        with self._lock:
+            value = self._lookup(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return value
+
+    # Whether the region's forecast for the period is cached, without counting a hit or miss
+    def has(self, region_id, window_start):
+        with self._lock:
+            return self._lookup((region_id, window_start)) is not None
+
+    def put(self, region_id, window_start, value, notify=True):
+        key = (region_id, window_start)
+        with self._lock:
+            self._store(key, value)
+        if notify and self.on_store is not None:
+            self.on_store(window_start, value)
+
+    # Most recent forecast stored for the region, even if its settlement period
+    # has passed, as a copy marked 'stale' so callers can tell it apart
+    def get_stale(self, region_id):
+        with self._lock:
+            entry = self._latest.get(region_id)
+            if entry is None:
+                return None
+            self.stale_hits += 1
+            return dict(entry[1], stale=True)
+
+    # Return the cached forecast, or run `loader` once however many threads miss at the same time.
+    # With `stale_ok`, a miss returns the region's previous forecast, marked 'stale',
+    # instead of loading, if there is one.
+    def get_or_load(self, region_id, window_start, loader, stale_ok=False):
+        key = (region_id, window_start)
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                self.hits += 1
+                return value
+            self.misses += 1
+            if stale_ok and region_id in self._latest:
+                self.stale_hits += 1
+                return dict(self._latest[region_id][1], stale=True)
+        return self.coalesce(key, loader, store=True)
+
+    # Run `loader` for `key` unless an identical load is already running, in which case wait for it
+    def coalesce(self, key, loader, store=False):
+        with self._lock:
+            call = self._inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self._inflight[key] = _InFlight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = loader()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            stored = store and call.error is None and call.value is not None
+            with self._lock:
+                if stored:
+                    self._store(key, call.value)
+                del self._inflight[key]
+            call.done.set()
+        if stored and self.on_store is not None:
+            self.on_store(key[1], call.value)
+        return call.value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'in_flight': len(self._inflight),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'coalesced': self.coalesced,
+                'stale_hits': self.stale_hits,
+            }
+
+    # Callers must hold self._lock
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if self.clock() >= expires_at:
+            del self._entries[key]
+            self.expirations += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _store(self, key, value):
+        expires_at = key[1] + SETTLEMENT_PERIOD
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        region_id, window_start = key
+        latest = self._latest.get(region_id)
+        if latest is None or latest[0] <= window_start:
+            self._latest[region_id] = (window_start, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
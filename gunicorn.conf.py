@@ -0,0 +1,53 @@
+import os
+import shutil
+import tempfile
+
+# Production server settings, read by `gunicorn app:app`. Everything can be
+# tuned from the environment without a code change.
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Heroku sets WEB_CONCURRENCY to suit the dyno size
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+worker_class = "gthread"
+
+# Load the app (templates, outcode index, landing page) once in the master so
+# workers share it copy-on-write
+preload_app = True
+
+# Recycle workers gradually so slow leaks can't build up, without restarting them all at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", 1000))
+max_requests_jitter = int(os.environ.get("GUNICORN_MAX_REQUESTS_JITTER", 100))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+
+# Keep idle client connections open a little longer than the router in front of us
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG", "-")
+
+# Workers share their metrics through files in this directory, so /metrics
+# reports for all of them whichever worker answers. Unless METRICS_DIR is set,
+# it is a new temporary directory for this server, made before the app is preloaded.
+METRICS_DIR_PREFIX = "search-metrics-"
+if "METRICS_DIR" not in os.environ:
+    os.environ["METRICS_DIR"] = tempfile.mkdtemp(prefix=METRICS_DIR_PREFIX)
+
+# Threads don't survive fork(), so background tasks start in each worker
+def post_fork(server, worker):
+    from app import start_background_tasks
+    start_background_tasks()
+
+# Leave the exiting worker's final counts for the others to report, and its
+# last forecasts in the snapshot
+def worker_exit(server, worker):
+    from app import metrics_store, snapshot_writer
+    if metrics_store:
+        metrics_store.write()
+    if snapshot_writer:
+        snapshot_writer.flush(timeout=5)
+
+def on_exit(server):
+    if os.path.basename(os.environ["METRICS_DIR"]).startswith(METRICS_DIR_PREFIX):
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
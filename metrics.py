@@ -0,0 +1,244 @@
+import fcntl
+import json
+import os
+import threading
+import time
+
+from upstream import LatencyHistogram
+
+# A minimal Prometheus client: counters and histograms with labels, plus
+# collector callbacks for values that live elsewhere (cache and upstream
+# counters), rendered in the text exposition format. Recording is a dict lookup
+# and an addition under a lock, cheap enough to leave on in production.
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+def _number(value):
+    if value is None:
+        return 'NaN'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+# A metric family ready to render: name, type, help text and
+# [(sample name, ((label, value), ...), value)]
+class Family:
+    def __init__(self, name, kind, help, samples=None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.samples = samples or []
+
+    def add(self, value, suffix='', **labels):
+        self.samples.append((self.name + suffix, tuple(labels.items()), value))
+        return self
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(f"{name}{_labels(labels)} {_number(value)}" for name, labels, value in self.samples)
+        return '\n'.join(lines)
+
+def histogram_samples(family, snapshot, **labels):
+    for bound, count in snapshot['buckets'].items():
+        family.add(count, '_bucket', **labels, le=bound)
+    family.add(snapshot['count'], '_count', **labels)
+    family.add(snapshot['sum'], '_sum', **labels)
+
+class Counter:
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            values = dict(self._values)
+        return Family(self.name, 'counter', self.help, [(self.name, key, value) for key, value in values.items()])
+
+class Histogram:
+    def __init__(self, name, help, buckets=LatencyHistogram.BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(labels.items())
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram(self.buckets))
+        histogram.observe(seconds)
+
+    def collect(self):
+        family = Family(self.name, 'histogram', self.help)
+        with self._lock:
+            histograms = dict(self._histograms)
+        for key, histogram in histograms.items():
+            histogram_samples(family, histogram.snapshot(), **dict(key))
+        return family
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help):
+        metric = Counter(name, help)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, buckets=LatencyHistogram.BUCKETS):
+        metric = Histogram(name, help, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    # `collector` is called on every scrape and returns a list of Family
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def collect(self):
+        families = [metric.collect() for metric in self._metrics]
+        for collector in self._collectors:
+            families.extend(collector())
+        return families
+
+    def render(self):
+        return render_families(self.collect())
+
+def render_families(families):
+    return '\n'.join(family.render() for family in families if family.samples) + '\n'
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Metrics of every worker process, so whichever worker answers a scrape can
+# report for all of them. Each worker writes its families to <pid>.json in
+# `directory`, every `interval` seconds and whenever it answers a scrape. A
+# scrape sums the counters and histograms of all the files and reports gauges
+# per live worker, with a `worker` label. The files of workers that have exited
+# are folded into archive.json, so counters don't go backwards when gunicorn
+# recycles a worker.
+class MultiprocessStore:
+    ARCHIVE = 'archive.json'
+
+    def __init__(self, directory, registry, interval=5):
+        self.directory = directory
+        self.registry = registry
+        self.interval = interval
+        self._thread = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self):
+        self._dump(f"{os.getpid()}.json", self.registry.collect())
+
+    # Replace the file whole, so a reader never sees half of it
+    def _dump(self, name, families):
+        path = self._path(name)
+        with open(path + '.tmp', 'w') as f:
+            json.dump([[family.name, family.kind, family.help, family.samples] for family in families],
+                      f, separators=(',', ':'))
+        os.replace(path + '.tmp', path)
+
+    # Write this worker's file every `interval` seconds, from a daemon thread
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Failed to write metrics: {e}")
+
+    def _read(self, name):
+        try:
+            with open(self._path(name)) as f:
+                families = json.load(f)
+            return [
+                Family(family, kind, help, [(sample, tuple(map(tuple, labels)), value) for sample, labels, value in samples])
+                for family, kind, help, samples in families
+            ]
+        except (OSError, ValueError):
+            return []
+
+    def collect(self):
+        self.write()
+        with open(self._path('lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = self._read(self.ARCHIVE)
+            live = {}
+            exited = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json') or name == self.ARCHIVE:
+                    continue
+                pid = int(name[:-5])
+                if _alive(pid):
+                    live[pid] = self._read(name)
+                else:
+                    exited.append(name)
+
+            if exited:
+                archive = _merge([archive] + [self._read(name) for name in exited], cumulative_only=True)
+                self._dump(self.ARCHIVE, archive)
+                for name in exited:
+                    os.remove(self._path(name))
+
+        return _merge([archive] + list(live.values()), workers=list(live))
+
+    def render(self):
+        return render_families(self.collect())
+
+# Sum the counter and histogram samples of several processes' families. Gauges
+# only make sense per process: they are kept with a `worker` label (the pid in
+# `workers` at the same position, after the archive) unless `cumulative_only`.
+def _merge(sources, workers=(), cumulative_only=False):
+    merged = {}
+    for position, families in enumerate(sources):
+        worker = workers[position - 1] if 0 < position <= len(workers) else None
+        for family in families:
+            if family.kind == 'gauge' and (cumulative_only or worker is None):
+                continue
+            target = merged.get(family.name)
+            if target is None:
+                target = merged[family.name] = (Family(family.name, family.kind, family.help), {})
+            result, totals = target
+            for sample, labels, value in family.samples:
+                if family.kind == 'gauge':
+                    result.samples.append((sample, labels + (('worker', worker),), value))
+                    continue
+                key = (sample, labels)
+                if key not in totals:
+                    totals[key] = len(result.samples)
+                    result.samples.append((sample, labels, value))
+                else:
+                    index = totals[key]
+                    result.samples[index] = (sample, labels, result.samples[index][2] + value)
+    return [result for result, _ in merged.values()]
@@ -0,0 +1,75 @@
+import os
+import re
+import threading
+
+DATA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'outcode_regions.txt')
+
+# Carbon Intensity regional ids and their short names
+REGION_NAMES = {
+    1: 'North Scotland',
+    2: 'South Scotland',
+    3: 'North West England',
+    4: 'North East England',
+    5: 'Yorkshire',
+    6: 'North Wales & Merseyside',
+    7: 'South Wales',
+    8: 'West Midlands',
+    9: 'East Midlands',
+    10: 'East England',
+    11: 'South West England',
+    12: 'South England',
+    13: 'London',
+    14: 'South East England',
+}
+
+POSTCODE_PATTERN = re.compile(r'^([A-Z]{1,2}[0-9][A-Z0-9]?)([0-9][A-Z]{2})$')
+AREA_PATTERN = re.compile(r'^[A-Z]{1,2}')
+
+# Split a UK postcode into (outward code, inward code), or return None if it is malformed
+def parse_postcode(postcode):
+    compact = re.sub(r'\s+', '', postcode or '').upper()
+    match = POSTCODE_PATTERN.match(compact)
+    if not match:
+        return None
+    return match.group(1), match.group(2)
+
+# Index from outward code to Carbon Intensity region, backed by the bundled data
+# file and topped up with regions learned from upstream answers at runtime
+class OutcodeIndex:
+    def __init__(self, areas=None, outcodes=None, on_learn=None):
+        self.areas = dict(areas or {})
+        self.outcodes = dict(outcodes or {})
+        # Called with (outward code, region id) for every newly learned outward code
+        self.on_learn = on_learn
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=DATA_FILE, on_learn=None):
+        areas = {}
+        outcodes = {}
+        with open(path) as f:
+            for line in f:
+                line = line.split('#', 1)[0].split()
+                if not line:
+                    continue
+                region_id = int(line[0])
+                for code in line[1:]:
+                    if AREA_PATTERN.fullmatch(code):
+                        areas[code] = region_id
+                    else:
+                        outcodes[code] = region_id
+        return cls(areas, outcodes, on_learn)
+
+    def region_for(self, outward_code):
+        region_id = self.outcodes.get(outward_code)
+        if region_id is not None:
+            return region_id
+        area = AREA_PATTERN.match(outward_code)
+        return self.areas.get(area.group(0)) if area else None
+
+    def learn(self, outward_code, region_id, notify=True):
+        with self._lock:
+            known = self.outcodes.get(outward_code) == region_id
+            self.outcodes[outward_code] = region_id
+        if notify and not known and self.on_learn is not None:
+            self.on_learn(outward_code, region_id)
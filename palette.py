@@ -0,0 +1,54 @@
+import hashlib
+
+# Colour stops of the tile scale as (percentage, (r, g, b)). Colours are
+# interpolated linearly between stops and held flat beyond the first and last.
+DEFAULT_STOPS = (
+    (0, (230, 230, 230)),   # Light grey for percentages under 25%
+    (25, (230, 230, 230)),
+    (50, (173, 255, 47)),   # Light green (lime green base)
+    (70, (50, 205, 50)),    # Lime green
+    (100, (0, 255, 0)),     # Very bright green
+)
+
+def interpolate(stops, percentage):
+    if percentage <= stops[0][0]:
+        return stops[0][1]
+    for (low, low_color), (high, high_color) in zip(stops, stops[1:]):
+        if percentage < high:
+            if low_color == high_color:
+                return low_color
+            factor = (percentage - low) / (high - low)
+            return tuple(int(low_color[i] * (1 - factor) + high_color[i] * factor) for i in range(3))
+    return stops[-1][1]
+
+# The tile colour of every whole percentage from 0 to 100, computed once, plus
+# bands of `band_width` percentage points that share a CSS class and colour
+class Palette:
+    def __init__(self, stops=DEFAULT_STOPS, band_width=5):
+        self.stops = stops
+        self.band_width = band_width
+        self.colors = [self._rgb(interpolate(stops, percentage)) for percentage in range(101)]
+        self.classes = [f"band-{percentage // band_width}" for percentage in range(101)]
+
+        self.band_colors = {}
+        for band_start in range(0, 101, band_width):
+            middle = min(band_start + band_width // 2, 100)
+            self.band_colors[self.classes[band_start]] = self.colors[middle]
+
+        self.stylesheet = ''.join(
+            f".tile.{css_class}{{background-color:{color}}}\n" for css_class, color in self.band_colors.items())
+        self.fingerprint = hashlib.sha1(self.stylesheet.encode('utf-8')).hexdigest()[:12]
+
+    @staticmethod
+    def _rgb(color):
+        return f"rgb({color[0]},{color[1]},{color[2]})"
+
+    @staticmethod
+    def _index(percentage):
+        return min(max(int(percentage), 0), 100)
+
+    def color(self, percentage):
+        return self.colors[self._index(percentage)]
+
+    def css_class(self, percentage):
+        return self.classes[self._index(percentage)]
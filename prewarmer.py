@@ -0,0 +1,65 @@
+import threading
+from datetime import datetime
+
+from forecast_cache import SETTLEMENT_PERIOD, settlement_period_start
+
+# Background thread that calls `refresh(window_start)` at the start of every
+# settlement period. A failed refresh is retried after `retry_delay` seconds
+# until the period ends; meanwhile the previous forecasts keep being served.
+class ForecastPrewarmer:
+    def __init__(self, refresh, retry_delay=60, start_delay=5, clock=datetime.utcnow):
+        self.refresh = refresh
+        self.retry_delay = retry_delay
+        self.start_delay = start_delay
+        self.clock = clock
+        self.last_success = None
+        self.last_failure = None
+        self.failures = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='forecast-prewarmer', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            window_start = settlement_period_start(self.clock())
+            if self.last_success != window_start:
+                try:
+                    self.refresh(window_start)
+                except Exception as e:
+                    self.failures += 1
+                    self.last_failure = (window_start, repr(e))
+                    print(f"Failed to pre-warm forecasts: {e}")
+                else:
+                    self.last_success = window_start
+            self._stop.wait(self._seconds_until_next_attempt(window_start))
+
+    def _seconds_until_next_attempt(self, window_start):
+        # Give the upstream a few seconds into the new period before asking for it
+        next_period = (window_start + SETTLEMENT_PERIOD - self.clock()).total_seconds() + self.start_delay
+        if self.last_success == window_start:
+            return max(next_period, 0)
+        return max(min(self.retry_delay, next_period), 0)
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'last_success': self.last_success.isoformat() if self.last_success else None,
+            'last_failure': self.last_failure and {'window_start': self.last_failure[0].isoformat(), 'error': self.last_failure[1]},
+            'failures': self.failures,
+        }
@@ -0,0 +1,121 @@
+import json
+import os
+import queue
+import sqlite3
+import threading
+import zlib
+from datetime import datetime
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS forecasts (
+    region_id INTEGER PRIMARY KEY,
+    window_start TEXT NOT NULL,
+    shortname TEXT NOT NULL,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outcodes (
+    outcode TEXT PRIMARY KEY,
+    region_id INTEGER NOT NULL
+);
+'''
+
+# SQLite file holding the latest forecast of each region and the outward codes
+# learned at runtime, so a restarted worker starts warm instead of going back
+# to the network. Every worker process opens it separately, and the OS shares
+# its pages between them.
+class SnapshotStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    # One connection per thread, opened on first use so nothing is inherited across fork()
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+        return connection
+
+    def save_forecast(self, window_start, forecast):
+        data = zlib.compress(json.dumps(forecast['data'], separators=(',', ':')).encode('utf-8'))
+        self._connection().execute(
+            'INSERT INTO forecasts (region_id, window_start, shortname, data) VALUES (?, ?, ?, ?) '
+            'ON CONFLICT (region_id) DO UPDATE SET window_start = excluded.window_start, '
+            'shortname = excluded.shortname, data = excluded.data '
+            'WHERE excluded.window_start >= forecasts.window_start',
+            (forecast['regionid'], window_start.isoformat(), forecast['shortname'], data))
+
+    # [(window start, forecast)] for every region in the snapshot
+    def load_forecasts(self):
+        rows = self._connection().execute('SELECT region_id, window_start, shortname, data FROM forecasts')
+        return [
+            (datetime.fromisoformat(window_start), {
+                'regionid': region_id,
+                'shortname': shortname,
+                'data': json.loads(zlib.decompress(data)),
+            })
+            for region_id, window_start, shortname, data in rows
+        ]
+
+    def save_outcode(self, outward_code, region_id):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO outcodes (outcode, region_id) VALUES (?, ?)', (outward_code, region_id))
+
+    def load_outcodes(self):
+        return dict(self._connection().execute('SELECT outcode, region_id FROM outcodes'))
+
+# Makes a store's writes on a background thread, so no caller waits on SQLite's
+# write lock: not a request thread, and not the event loop in asgi.py. The
+# snapshot is only a warm start, so writes beyond `max_pending` are dropped
+# rather than queued without bound.
+class SnapshotWriter:
+    def __init__(self, store, max_pending=1000):
+        self.store = store
+        self.max_pending = max_pending
+        self.dropped = 0
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def save_forecast(self, window_start, forecast):
+        self._put(self.store.save_forecast, window_start, forecast)
+
+    def save_outcode(self, outward_code, region_id):
+        self._put(self.store.save_outcode, outward_code, region_id)
+
+    # Wait up to `timeout` seconds for the writes queued so far, e.g. before a worker exits
+    def flush(self, timeout=None):
+        done = threading.Event()
+        try:
+            self._writes().put((done.set, ()), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _put(self, write, *args):
+        try:
+            self._writes().put_nowait((write, args))
+        except queue.Full:
+            self.dropped += 1
+
+    # The queue, with a thread draining it in this process; threads don't survive fork()
+    def _writes(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(self.max_pending)
+                self._thread = threading.Thread(target=self._run, args=(self._queue,), name='snapshot-writer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+            return self._queue
+
+    def _run(self, writes):
+        while True:
+            write, args = writes.get()
+            try:
+                write(*args)
+            except sqlite3.Error as e:
+                print(f"Failed to save snapshot: {e}")
@@ -0,0 +1,5 @@
+import os
+
+# Keep the app under test off the shared snapshot file and out of the rate limiter
+os.environ.setdefault('FORECAST_SNAPSHOT_PATH', '')
+os.environ.setdefault('SEARCH_RATE_LIMIT', '0')
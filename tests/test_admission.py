@@ -0,0 +1,72 @@
+import asyncio
+import threading
+import time
+
+from admission import AsyncConcurrencyLimiter, ConcurrencyLimiter, RateLimiter, TokenBucket
+
+def test_token_bucket_allows_a_burst_then_refills_at_the_rate():
+    bucket = TokenBucket(rate=0.5, burst=2, now=0)
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 2
+    assert bucket.take(1) == 1
+    assert bucket.take(2) == 0
+
+def test_rate_limiter_keeps_a_bucket_per_client():
+    now = [0]
+    limiter = RateLimiter(rate=1, burst=1, clock=lambda: now[0])
+    assert limiter.check('a') == 0
+    assert limiter.check('a') == 1
+    assert limiter.check('b') == 0
+    now[0] = 1
+    assert limiter.check('a') == 0
+    assert limiter.stats() == {'allowed': 3, 'limited': 1, 'clients': 2}
+
+def test_rate_limiter_forgets_the_least_recently_seen_client():
+    limiter = RateLimiter(rate=1, burst=1, max_clients=2, clock=lambda: 0)
+    limiter.check('a')
+    limiter.check('b')
+    limiter.check('a')
+    limiter.check('c')
+    assert set(limiter._buckets) == {'a', 'c'}
+
+def test_concurrency_limiter_sheds_beyond_the_queue():
+    limiter = ConcurrencyLimiter(1, max_waiting=0, timeout=1)
+    assert limiter.acquire()
+    assert not limiter.acquire()
+    limiter.release()
+    assert limiter.acquire()
+    assert limiter.stats()['shed'] == 1
+
+def test_concurrency_limiter_queue_waits_for_a_slot_or_times_out():
+    limiter = ConcurrencyLimiter(1, max_waiting=1, timeout=0.1)
+    assert limiter.acquire()
+    started = time.monotonic()
+    assert not limiter.acquire()
+    assert time.monotonic() - started >= 0.09
+
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(limiter.acquire(timeout=5)))
+    waiter.start()
+    while limiter.waiting == 0:
+        time.sleep(0.01)
+    # The queue is full, so a third caller is turned away at once
+    assert not limiter.acquire(timeout=5)
+    limiter.release()
+    waiter.join()
+    assert results == [True]
+    assert limiter.stats()['active'] == 1
+
+def test_async_concurrency_limiter():
+    async def run():
+        limiter = AsyncConcurrencyLimiter(1, max_waiting=1, timeout=0.05)
+        assert await limiter.acquire()
+        assert await limiter.acquire() is False
+        waiter = asyncio.ensure_future(limiter.acquire(timeout=5))
+        await asyncio.sleep(0)
+        assert await limiter.acquire() is False
+        limiter.release()
+        assert await waiter is True
+        assert limiter.stats()['shed'] == 2
+
+    asyncio.run(run())
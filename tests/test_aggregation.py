@@ -0,0 +1,75 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from aggregation import aggregate_generation_mix
+
+FUELS = ('biomass', 'coal', 'imports', 'gas', 'nuclear', 'other', 'hydro', 'solar', 'wind')
+
+# group_data_by_hour as it was before aggregate_generation_mix replaced it,
+# widened to any bucket size and the per-fuel breakdown
+def legacy_aggregate(combined_data, bucket_minutes=60, breakdown=False):
+    buckets = {}
+    for entry in combined_data:
+        timestamp = datetime.strptime(entry['from'], "%Y-%m-%dT%H:%MZ")
+        minute_of_day = timestamp.hour * 60 + timestamp.minute
+        minute_of_day -= minute_of_day % bucket_minutes
+        bucket = timestamp.replace(hour=minute_of_day // 60, minute=minute_of_day % 60)
+
+        wind_perc = next((item['perc'] for item in entry['generationmix'] if item['fuel'] == 'wind'), 0)
+        solar_perc = next((item['perc'] for item in entry['generationmix'] if item['fuel'] == 'solar'), 0)
+        hydro_perc = next((item['perc'] for item in entry['generationmix'] if item['fuel'] == 'hydro'), 0)
+        combined_renewable_perc = wind_perc + solar_perc + hydro_perc
+
+        if bucket not in buckets:
+            buckets[bucket] = {'count': 0, 'total_renewable_perc': 0, 'fuels': {'wind': 0, 'solar': 0, 'hydro': 0}}
+        buckets[bucket]['count'] += 1
+        buckets[bucket]['total_renewable_perc'] += combined_renewable_perc
+        for fuel, perc in (('wind', wind_perc), ('solar', solar_perc), ('hydro', hydro_perc)):
+            buckets[bucket]['fuels'][fuel] += perc
+
+    for data in buckets.values():
+        data['average_renewable_perc'] = round(data['total_renewable_perc'] / data['count'])
+        if breakdown:
+            data['fuels'] = {fuel: round(total / data['count'], 1) for fuel, total in data['fuels'].items()}
+        else:
+            del data['fuels']
+    return buckets
+
+# 48 hours of half-hourly rows from an odd start, some with renewables missing from the mix
+def forecast_rows(seed, start=datetime(2024, 3, 30, 22, 30), periods=96):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(periods):
+        period_start = start + timedelta(minutes=30 * i)
+        fuels = [fuel for fuel in FUELS if rng.random() > 0.1]
+        shares = [rng.random() for _ in fuels]
+        scale = 100 / sum(shares)
+        rows.append({
+            'from': period_start.strftime("%Y-%m-%dT%H:%MZ"),
+            'to': (period_start + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%MZ"),
+            'generationmix': [{'fuel': fuel, 'perc': round(share * scale, 1)} for fuel, share in zip(fuels, shares)],
+        })
+    return rows
+
+@pytest.mark.parametrize('bucket_minutes', [30, 60, 180])
+@pytest.mark.parametrize('breakdown', [False, True])
+def test_matches_the_legacy_aggregation(bucket_minutes, breakdown):
+    for seed in range(5):
+        rows = forecast_rows(seed)
+        expected = legacy_aggregate(rows, bucket_minutes, breakdown)
+        actual = aggregate_generation_mix(rows, bucket_minutes, breakdown=breakdown)
+        assert list(actual) == list(expected)
+        for bucket, data in expected.items():
+            assert actual[bucket]['count'] == data['count']
+            assert actual[bucket]['total_renewable_perc'] == pytest.approx(data['total_renewable_perc'])
+            assert actual[bucket]['average_renewable_perc'] == data['average_renewable_perc']
+            if breakdown:
+                assert actual[bucket]['fuels'] == data['fuels']
+            else:
+                assert 'fuels' not in actual[bucket]
+
+def test_rejects_buckets_that_do_not_divide_the_day():
+    with pytest.raises(ValueError):
+        aggregate_generation_mix(forecast_rows(0), bucket_minutes=45)
@@ -0,0 +1,240 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import app as search_app
+from forecast_cache import SETTLEMENT_PERIOD, ForecastCache, settlement_period_start
+from outcodes import OutcodeIndex
+from upstream import UpstreamBusyError
+
+def rows(start, periods=4):
+    return [
+        {
+            'from': (start + SETTLEMENT_PERIOD * i).strftime("%Y-%m-%dT%H:%MZ"),
+            'to': (start + SETTLEMENT_PERIOD * (i + 1)).strftime("%Y-%m-%dT%H:%MZ"),
+            'generationmix': [{'fuel': 'wind', 'perc': 40.0}, {'fuel': 'gas', 'perc': 60.0}],
+        }
+        for i in range(periods)
+    ]
+
+def region_forecast(region_id, start):
+    return {'regionid': region_id, 'shortname': search_app.REGION_NAMES[region_id], 'data': rows(start)}
+
+class FakeResponse:
+    def __init__(self, status_code, payload):
+        self.status_code = status_code
+        self.payload = payload
+
+    def json(self):
+        return self.payload
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise search_app.requests.exceptions.HTTPError(f"{self.status_code} error")
+
+# Stands in for the shared UpstreamClient, answering like Postcodes.io and the
+# Carbon Intensity API and recording every URL it is asked for
+class FakeUpstream:
+    def __init__(self, region_id=13, outcodes=None):
+        self.region_id = region_id
+        self.outcodes = outcodes or {}
+        self.urls = []
+
+    def get(self, url):
+        self.urls.append(url)
+        if '/postcodes/' in url:
+            postcode = url.rsplit('/', 1)[1]
+            outcode = self.outcodes.get(postcode)
+            if outcode is None:
+                return FakeResponse(404, {'status': 404, 'error': "Invalid postcode"})
+            return FakeResponse(200, {'status': 200, 'result': {'postcode': postcode, 'outcode': outcode}})
+        return FakeResponse(200, {'data': region_forecast(self.region_id, settlement_period_start())})
+
+    # Postcodes.io's bulk lookup
+    def post(self, url, json):
+        self.urls.append(url)
+        return FakeResponse(200, {'status': 200, 'result': [
+            {'query': postcode, 'result': {'postcode': postcode, 'outcode': self.outcodes[postcode]}
+             if postcode in self.outcodes else None}
+            for postcode in json['postcodes']
+        ]})
+
+    def calls(self, kind):
+        return [url for url in self.urls if ('/postcodes' in url) == (kind == 'postcodes')]
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(search_app, 'forecast_cache', ForecastCache())
+    monkeypatch.setattr(search_app, 'outcode_index', OutcodeIndex.load())
+    monkeypatch.setattr(search_app, 'confirmed_outcodes', set())
+    monkeypatch.setattr(search_app, 'unknown_postcodes', search_app.UnknownPostcodes())
+    return search_app.app.test_client()
+
+@pytest.fixture
+def upstream(monkeypatch):
+    fake = FakeUpstream()
+    monkeypatch.setattr(search_app, 'upstream', fake)
+    return fake
+
+def test_search_makes_exactly_one_forecast_call(client, upstream):
+    response = client.post('/', data={'postcode': 'EC1A 1BB'})
+    assert response.status_code == 200
+    assert 'class="calendar"' in response.get_data(as_text=True)
+    assert len(upstream.calls('forecast')) == 1
+    assert upstream.calls('postcodes') == []
+
+def test_searches_in_the_same_region_and_period_share_the_forecast_call(client, upstream):
+    client.post('/', data={'postcode': 'EC1A 1BB'})
+    client.post('/', data={'postcode': 'EC2A 4NE'})
+    assert len(upstream.calls('forecast')) == 1
+
+def test_search_for_an_unlisted_outcode_checks_it_then_makes_one_forecast_call(client, upstream, monkeypatch):
+    monkeypatch.setattr(search_app, 'outcode_index', OutcodeIndex())
+    upstream.outcodes['EC1A 1BB'] = 'EC1A'
+
+    response = client.post('/', data={'postcode': 'EC1A 1BB'})
+    assert 'class="calendar"' in response.get_data(as_text=True)
+    assert len(upstream.calls('postcodes')) == 1
+    assert len(upstream.calls('forecast')) == 1
+    assert upstream.calls('forecast')[0].endswith('/postcode/EC1A')
+
+def test_unknown_postcode_is_only_looked_up_once(client, upstream):
+    for _ in range(2):
+        response = client.post('/', data={'postcode': 'SK1 9ZZ'})
+        assert "Invalid postcode" in response.get_data(as_text=True)
+    assert len(upstream.calls('postcodes')) == 1
+    assert upstream.calls('forecast') == []
+
+def test_unknown_postcodes_forget_the_least_recently_seen():
+    unknown = search_app.UnknownPostcodes(max_size=2)
+    unknown.add('SK1 9ZZ')
+    unknown.add('GL1 9ZZ')
+    assert 'SK1 9ZZ' in unknown
+    unknown.add('CR0 9ZZ')
+    assert 'GL1 9ZZ' not in unknown
+    assert 'SK1 9ZZ' in unknown and 'CR0 9ZZ' in unknown
+
+def test_forecast_served_while_the_prewarmer_catches_up_is_marked_stale(client, monkeypatch):
+    previous = settlement_period_start() - SETTLEMENT_PERIOD
+    search_app.forecast_cache.put(13, previous, region_forecast(13, previous), notify=False)
+    monkeypatch.setattr(search_app, 'prewarmer', SimpleNamespace(running=True))
+    monkeypatch.setattr(search_app, 'fetch_region_forecast', lambda path, window_start: pytest.fail("called upstream"))
+
+    response = client.get('/api/forecast/EC1A1BB')
+    assert response.status_code == 200
+    assert response.json['stale'] is True
+    assert 'public' not in response.headers['Cache-Control']
+    assert response.headers['Cache-Control'] == 'no-cache'
+
+    html = client.post('/', data={'postcode': 'EC1A 1BB'}).get_data(as_text=True)
+    assert 'stale-notice' in html
+
+def test_partial_prewarm_is_retried_for_the_missing_regions(client, monkeypatch):
+    window_start = settlement_period_start()
+    calls = []
+
+    def fetch_all(window_start):
+        raise search_app.requests.exceptions.ConnectionError("down")
+
+    def fetch_region(path, window_start):
+        calls.append(path)
+        region_id = int(path.rsplit('/', 1)[1])
+        if region_id == 13 and len(calls) <= len(search_app.REGION_NAMES):
+            raise search_app.requests.exceptions.ConnectionError("down")
+        return region_forecast(region_id, window_start)
+    monkeypatch.setattr(search_app, 'fetch_all_region_forecasts', fetch_all)
+    monkeypatch.setattr(search_app, 'fetch_region_forecast', fetch_region)
+
+    with pytest.raises(search_app.IncompleteRefresh):
+        search_app.refresh_all_forecasts(window_start)
+    assert not search_app.forecast_cache.has(13, window_start)
+    assert search_app.forecast_cache.has(14, window_start)
+
+    search_app.refresh_all_forecasts(window_start)
+    assert calls[len(search_app.REGION_NAMES):] == ['/regionid/13']
+    assert search_app.forecast_cache.has(13, window_start)
+
+def test_batch_is_not_cacheable(client, monkeypatch):
+    def fail(path, window_start):
+        raise search_app.requests.exceptions.ConnectionError("down")
+    monkeypatch.setattr(search_app, 'fetch_region_forecast', fail)
+
+    response = client.post('/api/forecast/batch', json=['EC1A 1BB', 'nonsense'])
+    lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) == 2 and all('"error"' in line for line in lines)
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert 'ETag' not in response.headers
+
+def test_batch_csv_marks_stale_forecasts(client, monkeypatch):
+    previous = settlement_period_start() - SETTLEMENT_PERIOD
+    search_app.forecast_cache.put(13, previous, region_forecast(13, previous), notify=False)
+    monkeypatch.setattr(search_app, 'prewarmer', SimpleNamespace(running=True))
+
+    response = client.post('/api/forecast/batch?format=csv', json=['EC1A 1BB'])
+    rows = list(search_app.csv.DictReader(response.get_data(as_text=True).splitlines()))
+    assert rows and all(row['stale'] == 'True' for row in rows)
+
+def test_batch_checks_unlisted_postcodes_in_one_call(client, upstream):
+    upstream.outcodes = {'SK1 1EB': 'SK1', 'GL1 2EH': 'GL1'}
+    response = client.post('/api/forecast/batch', json=['SK1 1EB', 'GL1 2EH', 'SK1 9ZZ', 'EC1A 1BB'])
+    documents = [search_app.json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert sorted(document['postcode'] for document in documents if 'error' not in document) == [
+        'EC1A 1BB', 'GL1 2EH', 'SK1 1EB']
+    assert [document['postcode'] for document in documents if 'error' in document] == ['SK1 9ZZ']
+    assert len(upstream.calls('postcodes')) == 1
+
+def test_batch_charges_the_rate_limit_per_unlisted_postcode(client, upstream, monkeypatch):
+    monkeypatch.setattr(search_app, 'rate_limiter', search_app.RateLimiter(1 / 60, 3))
+    upstream.outcodes = {f'SK1 {n}AA': 'SK1' for n in range(1, 5)}
+    response = client.post('/api/forecast/batch', json=['EC1A 1BB'] + list(upstream.outcodes))
+    errors = [line for line in response.get_data(as_text=True).splitlines() if '"error"' in line]
+    # One token for the request and one for each of the first two lookups
+    assert len(errors) == 2 and all('Too many postcode lookups' in line for line in errors)
+
+def test_shed_postcode_lookup_asks_the_user_to_try_again(client, monkeypatch):
+    def busy(url):
+        raise UpstreamBusyError("Too many upstream calls in flight")
+    monkeypatch.setattr(search_app, 'upstream', SimpleNamespace(get=busy))
+    monkeypatch.setattr(search_app, 'outcode_index', OutcodeIndex())
+
+    html = client.post('/', data={'postcode': 'ZZ1 1AA'}).get_data(as_text=True)
+    assert "try again in a moment" in html
+    assert "Invalid postcode" not in html
+
+    response = client.get('/api/forecast/ZZ11AA')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
+
+def test_client_address_only_comes_from_x_forwarded_for_behind_a_proxy(monkeypatch):
+    from werkzeug.middleware.proxy_fix import ProxyFix
+
+    from admission import RateLimiter
+
+    assert search_app.PROXY_HOPS == 0
+    assert not isinstance(search_app.app.wsgi_app, ProxyFix)
+    monkeypatch.setattr(search_app, 'rate_limiter', RateLimiter(rate=1 / 60, burst=1))
+    client = search_app.app.test_client()
+    assert client.get('/api/forecast/nonsense').status_code == 400
+    spoofed = client.get('/api/forecast/nonsense', headers={'X-Forwarded-For': '203.0.113.9'})
+    assert spoofed.status_code == 429
+
+def test_streamed_search_is_timed_until_the_body_is_sent(client, upstream, monkeypatch):
+    monkeypatch.setattr(search_app, 'STREAM_SEARCH_RESULTS', True)
+    histogram = search_app.request_seconds._histograms.get((('endpoint', 'index'),))
+    before = histogram.snapshot() if histogram else {'count': 0, 'sum': 0}
+
+    def slow_fetch(path, window_start):
+        time.sleep(0.2)
+        return search_app.parse_region_forecast(upstream.get(search_app.region_forecast_url(path, window_start)).json())
+    monkeypatch.setattr(search_app, 'fetch_region_forecast', slow_fetch)
+
+    response = client.post('/', data={'postcode': 'EC1A 1BB'}, headers={'X-Server-Timing': '1'})
+    assert response.is_streamed
+    assert 'total' not in response.headers.get('Server-Timing', '')
+    assert 'class="calendar"' in response.get_data(as_text=True)
+    response.close()
+
+    after = search_app.request_seconds._histograms[(('endpoint', 'index'),)].snapshot()
+    assert after['count'] == before['count'] + 1
+    assert after['sum'] - before['sum'] >= 0.2
@@ -0,0 +1,42 @@
+import asyncio
+
+import asgi
+from forecast_cache import SETTLEMENT_PERIOD, settlement_period_start
+
+def region_forecast(region_id, start, periods=4):
+    return {'regionid': region_id, 'shortname': 'London', 'data': [
+        {
+            'from': (start + SETTLEMENT_PERIOD * i).strftime("%Y-%m-%dT%H:%MZ"),
+            'to': (start + SETTLEMENT_PERIOD * (i + 1)).strftime("%Y-%m-%dT%H:%MZ"),
+            'generationmix': [{'fuel': 'wind', 'perc': 40.0}, {'fuel': 'gas', 'perc': 60.0}],
+        }
+        for i in range(periods)
+    ]}
+
+# Run one request through the ASGI app, returning the response start message and body
+def call(app, method, path, body=b'', headers=()):
+    scope = {'type': 'http', 'method': method, 'path': path, 'headers': list(headers), 'client': ('127.0.0.1', 1)}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent[0], b''.join(message.get('body', b'') for message in sent[1:])
+
+def test_search_returns_server_timing_when_asked(monkeypatch):
+    async def forecast(region_id, window_start):
+        return region_forecast(region_id, settlement_period_start())
+    monkeypatch.setattr(asgi, 'region_forecast', forecast)
+
+    start, body = call(asgi.app, 'POST', '/', b'postcode=EC1A+1BB', [(b'x-server-timing', b'1')])
+    assert start['status'] == 200 and b'class="calendar"' in body
+    timing = dict(start['headers'])[b'server-timing'].decode('ascii')
+    assert [span.split(';')[0] for span in timing.split(', ')] == ['forecast', 'aggregate', 'render', 'total']
+
+    start, _ = call(asgi.app, 'POST', '/', b'postcode=EC1A+1BB')
+    assert b'server-timing' not in dict(start['headers'])
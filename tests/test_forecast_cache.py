@@ -0,0 +1,96 @@
+import threading
+import time
+from datetime import datetime
+
+from forecast_cache import SETTLEMENT_PERIOD, ForecastCache
+
+WINDOW = datetime(2024, 6, 1, 12, 0)
+
+def forecast(region_id, label):
+    return {'regionid': region_id, 'shortname': label, 'data': []}
+
+def test_previous_forecast_is_served_marked_stale():
+    cache = ForecastCache(clock=lambda: WINDOW + SETTLEMENT_PERIOD)
+    cache.put(3, WINDOW, forecast(3, 'old'))
+
+    stale = cache.get_or_load(3, WINDOW + SETTLEMENT_PERIOD, lambda: None, stale_ok=True)
+    assert stale == dict(forecast(3, 'old'), stale=True)
+    assert cache.get_stale(3)['stale'] is True
+    # The cached forecast itself is left unmarked
+    assert 'stale' not in cache._latest[3][1]
+    assert cache.stats()['stale_hits'] == 2
+
+def test_hit_until_the_settlement_period_ends():
+    now = [WINDOW]
+    cache = ForecastCache(clock=lambda: now[0])
+    cache.put(3, WINDOW, forecast(3, 'current'))
+    assert cache.get(3, WINDOW)['shortname'] == 'current'
+    now[0] = WINDOW + SETTLEMENT_PERIOD
+    assert cache.get(3, WINDOW) is None
+    assert cache.stats()['expirations'] == 1
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ForecastCache(max_entries=2, clock=lambda: WINDOW)
+    cache.put(1, WINDOW, forecast(1, 'a'))
+    cache.put(2, WINDOW, forecast(2, 'b'))
+    cache.get(1, WINDOW)
+    cache.put(3, WINDOW, forecast(3, 'c'))
+    assert cache.get(2, WINDOW) is None
+    assert cache.get(1, WINDOW) is not None
+    assert cache.stats()['evictions'] == 1
+
+def test_concurrent_misses_share_one_load():
+    cache = ForecastCache(clock=lambda: WINDOW)
+    release = threading.Event()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        release.wait(5)
+        return forecast(3, 'loaded')
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_load(3, WINDOW, loader)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while cache.stats()['coalesced'] < 7 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert len(results) == 8 and all(result['shortname'] == 'loaded' for result in results)
+    assert cache.get(3, WINDOW)['shortname'] == 'loaded'
+
+def test_a_failed_load_reaches_every_waiter_and_is_not_cached():
+    cache = ForecastCache(clock=lambda: WINDOW)
+    release = threading.Event()
+
+    def loader():
+        release.wait(5)
+        raise ValueError("bad payload")
+
+    errors = []
+
+    def search():
+        try:
+            cache.get_or_load(3, WINDOW, loader)
+        except ValueError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while cache.stats()['coalesced'] < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(errors) == 4
+    assert cache.get(3, WINDOW) is None
+    assert cache.stats()['in_flight'] == 0
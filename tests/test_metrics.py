@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+
+from metrics import Family, MultiprocessStore, Registry
+
+def exited_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+def families(requests, entries):
+    return [
+        Family('requests_total', 'counter', "Requests").add(requests, endpoint='index'),
+        Family('cache_entries', 'gauge', "Entries").add(entries),
+    ]
+
+def samples(rendered, name):
+    return sorted(line for line in rendered.splitlines() if line.startswith(name))
+
+def test_counters_are_summed_over_workers_and_survive_their_exit(tmp_path):
+    registry = Registry()
+    requests = registry.counter('requests_total', "Requests")
+    requests.inc(2, endpoint='index')
+    store = MultiprocessStore(str(tmp_path), registry)
+
+    other, gone = os.getppid(), exited_pid()
+    store._dump(f"{other}.json", families(3, 7))
+    store._dump(f"{gone}.json", families(5, 9))
+
+    rendered = store.render()
+    assert samples(rendered, 'requests_total') == ['requests_total{endpoint="index"} 10']
+    # Gauges are per live worker; the exited worker's are dropped
+    assert samples(rendered, 'cache_entries') == [f'cache_entries{{worker="{other}"}} 7']
+    assert rendered.count('# TYPE requests_total counter') == 1
+
+    # The exited worker's counts were folded into the archive
+    assert not (tmp_path / f"{gone}.json").exists()
+    requests.inc(endpoint='index')
+    assert samples(store.render(), 'requests_total') == ['requests_total{endpoint="index"} 11']
+
+def test_histograms_are_summed_bucket_by_bucket(tmp_path):
+    registry = Registry()
+    latency = registry.histogram('latency_seconds', "Latency", buckets=(0.1, 1.0))
+    latency.observe(0.05)
+    store = MultiprocessStore(str(tmp_path), registry)
+
+    other = Registry()
+    other.histogram('latency_seconds', "Latency", buckets=(0.1, 1.0)).observe(0.5)
+    store._dump(f"{os.getppid()}.json", other.collect())
+
+    assert samples(store.render(), 'latency_seconds') == [
+        'latency_seconds_bucket{le="+Inf"} 2',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 2',
+        'latency_seconds_count 2',
+        'latency_seconds_sum 0.55',
+    ]
@@ -0,0 +1,47 @@
+import pytest
+
+from outcodes import OutcodeIndex, parse_postcode
+
+@pytest.mark.parametrize('postcode, expected', [
+    ('SW1A 1AA', ('SW1A', '1AA')),
+    ('sw1a1aa', ('SW1A', '1AA')),
+    ('  M1   1AE ', ('M1', '1AE')),
+    ('EC1A 1BB', ('EC1A', '1BB')),
+    ('B33 8TH', ('B33', '8TH')),
+    ('CR2 6XH', ('CR2', '6XH')),
+])
+def test_parse_postcode(postcode, expected):
+    assert parse_postcode(postcode) == expected
+
+@pytest.mark.parametrize('postcode', ['', None, 'SW1A', '1AA SW1', 'SW1A 1A', 'ABC1 1AA', 'SW1A 1AAA'])
+def test_parse_postcode_rejects_malformed_input(postcode):
+    assert parse_postcode(postcode) is None
+
+def test_outward_codes_resolve_by_outcode_then_area():
+    index = OutcodeIndex(areas={'EC': 13}, outcodes={'EC4A': 12})
+    assert index.region_for('EC1A') == 13
+    assert index.region_for('EC4A') == 12
+    assert index.region_for('ZZ1') is None
+
+def test_learned_outward_codes_are_reported_once():
+    learned = []
+    index = OutcodeIndex(on_learn=lambda outcode, region_id: learned.append((outcode, region_id)))
+    index.learn('ZZ1', 4)
+    index.learn('ZZ1', 4)
+    assert index.region_for('ZZ1') == 4
+    assert learned == [('ZZ1', 4)]
+
+def test_bundled_index_covers_the_regions():
+    index = OutcodeIndex.load()
+    assert index.region_for('EC1A') == 13
+    assert index.region_for('M1') == 3
+    assert set(index.areas.values()) | set(index.outcodes.values()) == set(range(1, 15))
+
+def test_bundled_index_leaves_split_districts_to_the_upstream():
+    index = OutcodeIndex.load()
+    assert index.region_for('TD1') == 2
+    assert index.region_for('TD15') == 4
+    assert index.region_for('SE1') == 13
+    assert index.region_for('W1D') == 13
+    assert index.region_for('E4') is None
+    assert index.region_for('N9') is None
@@ -0,0 +1,44 @@
+import threading
+from datetime import datetime
+
+from snapshot_store import SnapshotStore, SnapshotWriter
+
+WINDOW_START = datetime(2024, 6, 1, 12, 0)
+
+def forecast(region_id):
+    return {'regionid': region_id, 'shortname': 'London', 'data': [{'from': '2024-06-01T12:00Z'}]}
+
+def test_writes_reach_the_store_once_flushed(tmp_path):
+    store = SnapshotStore(str(tmp_path / 'snapshot.sqlite3'))
+    writer = SnapshotWriter(store)
+    writer.save_forecast(WINDOW_START, forecast(13))
+    writer.save_outcode('SK1', 12)
+    assert writer.flush(timeout=5)
+    assert store.load_forecasts() == [(WINDOW_START, forecast(13))]
+    assert store.load_outcodes() == {'SK1': 12}
+
+# Stands in for a store whose writes wait on another process's lock
+class BlockedStore:
+    def __init__(self):
+        self.writing = threading.Event()
+        self.unblocked = threading.Event()
+        self.saved = []
+
+    def save_outcode(self, outward_code, region_id):
+        self.writing.set()
+        self.unblocked.wait(5)
+        self.saved.append(outward_code)
+
+def test_callers_never_wait_on_a_blocked_write():
+    store = BlockedStore()
+    writer = SnapshotWriter(store, max_pending=2)
+    writer.save_outcode('SK1', 12)
+    assert store.writing.wait(5)
+    for outward_code in ('SK2', 'SK3', 'SK4'):
+        writer.save_outcode(outward_code, 12)
+    assert store.saved == []
+    assert writer.dropped == 1
+
+    store.unblocked.set()
+    assert writer.flush(timeout=5)
+    assert store.saved == ['SK1', 'SK2', 'SK3']
@@ -0,0 +1,248 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from upstream import CircuitBreaker, CircuitOpenError, UpstreamClient
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+def test_breaker_opens_after_threshold_and_half_opens_after_timeout():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30, clock=clock)
+    assert breaker.state == 'closed'
+    breaker.record_failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+    clock.now = 30
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+    # Only one trial call at a time
+    assert not breaker.allow()
+
+def test_breaker_trial_success_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 30
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == 'closed'
+    assert breaker.allow() and breaker.allow()
+
+def test_breaker_trial_failure_reopens():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == 'open'
+    clock.now = 59
+    assert not breaker.allow()
+    clock.now = 60
+    assert breaker.allow()
+
+def test_abandoned_trial_lets_the_next_caller_try():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, clock=clock)
+    breaker.record_failure()
+    clock.now = 30
+    assert breaker.allow()
+    breaker.abandon()
+    assert breaker.state == 'half-open'
+    assert breaker.allow()
+
+def half_open_client(monkeypatch, outcome):
+    client = UpstreamClient(retries=0, failure_threshold=1, reset_timeout=30, sleep=lambda seconds: None)
+    host = client._host('http://upstream.test/x')
+    clock = FakeClock()
+    host.breaker.clock = clock
+    host.breaker.record_failure()
+    clock.now = 30
+
+    def get(url, timeout):
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+    monkeypatch.setattr(host.session, 'get', get)
+    return client, host
+
+@pytest.mark.parametrize('error', [
+    requests.exceptions.ChunkedEncodingError('truncated'),
+    requests.exceptions.ContentDecodingError('bad gzip'),
+    requests.exceptions.TooManyRedirects('loop'),
+])
+def test_any_requests_error_on_the_trial_call_reopens_the_circuit(monkeypatch, error):
+    client, host = half_open_client(monkeypatch, error)
+    with pytest.raises(type(error)):
+        client.get('http://upstream.test/x')
+    assert host.breaker.state == 'open'
+    host.breaker.clock.now = 60
+    assert host.breaker.allow()
+
+def test_unexpected_error_on_the_trial_call_does_not_wedge_the_circuit(monkeypatch):
+    client, host = half_open_client(monkeypatch, RuntimeError('bug'))
+    with pytest.raises(RuntimeError):
+        client.get('http://upstream.test/x')
+    assert host.breaker.state == 'half-open'
+    assert host.breaker.allow()
+
+def test_circuit_open_is_refused_without_calling(monkeypatch):
+    client, host = half_open_client(monkeypatch, FakeResponse(200))
+    host.breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        client.get('http://upstream.test/x')
+    assert host.rejected == 1
+
+def test_retryable_status_is_retried_then_returned(monkeypatch):
+    client = UpstreamClient(retries=2, failure_threshold=10, sleep=lambda seconds: None)
+    host = client._host('http://upstream.test/x')
+    statuses = iter([503, 502, 200])
+    monkeypatch.setattr(host.session, 'get', lambda url, timeout: FakeResponse(next(statuses)))
+    assert client.get('http://upstream.test/x').status_code == 200
+    assert host.retries == 2
+    assert host.breaker.state == 'closed'
+
+def test_cancelled_async_trial_does_not_wedge_the_circuit():
+    import asyncio
+
+    import httpx
+
+    from asgi import AsyncUpstreamClient
+
+    errors = iter([httpx.ConnectError('refused'), asyncio.CancelledError()])
+
+    async def handler(request):
+        raise next(errors)
+
+    async def run():
+        client = AsyncUpstreamClient(failure_threshold=1, reset_timeout=30)
+        client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with pytest.raises(httpx.ConnectError):
+            await client.get('http://upstream.test/x')
+        breaker = client.breakers['upstream.test']
+        breaker.opened_at -= 30
+        with pytest.raises(asyncio.CancelledError):
+            await client.get('http://upstream.test/x')
+        assert breaker.state == 'half-open'
+        assert breaker.allow()
+        await client.close()
+
+    asyncio.run(run())
+
+def slow_client(monkeypatch, seconds_per_call, **options):
+    clock = FakeClock()
+
+    def sleep(seconds):
+        clock.now += seconds
+
+    client = UpstreamClient(failure_threshold=100, sleep=sleep, clock=clock, **options)
+    host = client._host('http://upstream.test/x')
+    timeouts = []
+
+    def get(url, timeout):
+        timeouts.append(timeout)
+        clock.now += seconds_per_call
+        return FakeResponse(503)
+    monkeypatch.setattr(host.session, 'get', get)
+    return client, clock, timeouts
+
+def test_retries_stop_at_the_deadline(monkeypatch):
+    client, clock, timeouts = slow_client(monkeypatch, 5, retries=10, deadline=12, backoff=0.2, max_backoff=0.2)
+    assert client.get('http://upstream.test/x').status_code == 503
+    assert len(timeouts) == 3
+    assert clock.now <= 15.5
+
+def test_attempt_timeouts_shrink_to_the_time_left(monkeypatch):
+    client, clock, timeouts = slow_client(monkeypatch, 8, retries=1, deadline=12, backoff=0, max_backoff=0)
+    client.get('http://upstream.test/x')
+    assert timeouts[0] == (3.05, 10)
+    assert timeouts[1] == (3.05, 4)
+
+# A real HTTP server on a local port. /slow takes a second to answer; /flaky
+# answers 503 until it has been called twice. Records the client port of every
+# request, so reused connections show up as repeats.
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.ports.append(self.client_address[1])
+            server.calls[self.path] = server.calls.get(self.path, 0) + 1
+            calls = server.calls[self.path]
+        if self.path == '/slow':
+            time.sleep(1)
+        status = 503 if self.path == '/flaky' and calls <= 2 else 200
+        body = b'{}'
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # the client gave up waiting
+
+@pytest.fixture
+def stub():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.ports = []
+    server.calls = {}
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+def test_calls_reuse_a_pooled_connection(stub):
+    server, url = stub
+    client = UpstreamClient()
+    for _ in range(3):
+        assert client.get(f"{url}/ok").status_code == 200
+    assert len(server.ports) == 3 and len(set(server.ports)) == 1
+
+def test_retryable_status_is_retried_over_the_socket(stub):
+    server, url = stub
+    client = UpstreamClient(retries=2, backoff=0.01)
+    assert client.get(f"{url}/flaky").status_code == 200
+    assert server.calls['/flaky'] == 3
+    assert client.stats()[url.split('//')[1]]['retries'] == 2
+
+def test_read_timeout_is_enforced_over_the_socket(stub):
+    _, url = stub
+    client = UpstreamClient(read_timeout=0.2, retries=0)
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        client.get(f"{url}/slow")
+    assert time.monotonic() - started < 0.9
+
+def test_deadline_bounds_retries_over_the_socket(stub):
+    server, url = stub
+    client = UpstreamClient(read_timeout=0.3, retries=10, backoff=0.01, max_backoff=0.01, deadline=0.5,
+                            failure_threshold=100)
+    started = time.monotonic()
+    with pytest.raises(requests.exceptions.Timeout):
+        client.get(f"{url}/slow")
+    assert time.monotonic() - started < 0.9
+    assert server.calls['/slow'] >= 2
@@ -0,0 +1,234 @@
+import random
+import threading
+import time
+from bisect import bisect_left
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Raised instead of calling an upstream whose circuit breaker is open
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    pass
+
+# Raised instead of calling an upstream while too many calls are already in flight
+class UpstreamBusyError(requests.exceptions.ConnectionError):
+    pass
+
+# Stops calls to a host after repeated failures, then lets a single trial call
+# through once `reset_timeout` seconds have passed
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+    # For a call that ended without telling us anything about the host (e.g. it
+    # was cancelled): let the next caller make the trial call instead
+    def abandon(self):
+        with self._lock:
+            self._trial_running = False
+
+# Cumulative latency histogram in seconds, Prometheus style
+class LatencyHistogram:
+    BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += seconds
+
+    def snapshot(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.total
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {'buckets': buckets, 'count': cumulative, 'sum': round(total, 6)}
+
+# Connection pool, circuit breaker and latency histogram for one upstream host
+class _Host:
+    def __init__(self, pool_size, failure_threshold, reset_timeout):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.latency = LatencyHistogram()
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.rejected = 0
+        self.shed = 0
+        self.responses = {}
+
+    def count_response(self, status_code):
+        self.responses[status_code] = self.responses.get(status_code, 0) + 1
+
+# Shared HTTP client for the upstream APIs: pooled keep-alive connections per
+# host, connect/read timeouts, a bounded number of retries with jittered
+# exponential backoff, and a circuit breaker that fails fast while a host is down.
+# With a `limiter` (an admission.ConcurrencyLimiter), calls it turns away raise
+# UpstreamBusyError instead of waiting.
+#
+# A call, counting its wait for a limiter slot, its retries and the backoff
+# between them, gives up after `deadline` seconds. The read timeout applies to
+# each read from the socket rather than the whole body, so a response that
+# trickles in can still overrun it somewhat.
+class UpstreamClient:
+    def __init__(self, connect_timeout=3.05, read_timeout=10, retries=2, backoff=0.2,
+                 max_backoff=2.0, pool_size=10, failure_threshold=5, reset_timeout=30,
+                 sleep=time.sleep, limiter=None, deadline=12, clock=time.monotonic):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+        self.limiter = limiter
+        self.deadline = deadline
+        self.clock = clock
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _host(self, url):
+        netloc = urlsplit(url).netloc
+        with self._lock:
+            host = self._hosts.get(netloc)
+            if host is None:
+                host = self._hosts[netloc] = _Host(self.pool_size, self.failure_threshold, self.reset_timeout)
+            return host
+
+    # GET `url`, returning the response (which may be an error status once the
+    # retries or the time are spent) or raising a requests exception
+    def get(self, url):
+        return self._request(url, lambda session, timeout: session.get(url, timeout=timeout))
+
+    # POST `json` to `url`, in the same way. Only for calls that are safe to
+    # repeat, such as Postcodes.io's bulk lookup, since failed ones are retried.
+    def post(self, url, json):
+        return self._request(url, lambda session, timeout: session.post(url, json=json, timeout=timeout))
+
+    def _request(self, url, send):
+        host = self._host(url)
+        deadline = self.clock() + self.deadline
+        for attempt in range(self.retries + 1):
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            if self.limiter is not None and not self.limiter.acquire(min(self.limiter.timeout, deadline - self.clock())):
+                host.shed += 1
+                raise UpstreamBusyError(f"Too many upstream calls in flight to call {urlsplit(url).netloc}")
+
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                self._release()
+                raise requests.exceptions.Timeout(f"No time left to call {urlsplit(url).netloc}")
+
+            if not host.breaker.allow():
+                self._release()
+                host.rejected += 1
+                raise CircuitOpenError(f"Circuit open for {urlsplit(url).netloc}")
+
+            host.requests += 1
+            started = time.perf_counter()
+            try:
+                response = send(
+                    host.session, (min(self.connect_timeout, remaining), min(self.read_timeout, remaining)))
+            except requests.exceptions.RequestException:
+                host.latency.observe(time.perf_counter() - started)
+                host.failures += 1
+                host.breaker.record_failure()
+                if self._last_attempt(attempt, delay, deadline):
+                    raise
+            except BaseException:
+                host.breaker.abandon()
+                raise
+            else:
+                host.latency.observe(time.perf_counter() - started)
+                host.count_response(response.status_code)
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    host.breaker.record_success()
+                    return response
+                host.failures += 1
+                host.breaker.record_failure()
+                if self._last_attempt(attempt, delay, deadline):
+                    return response
+            finally:
+                self._release()
+
+            host.retries += 1
+            self.sleep(delay)
+
+    # No retries left, or not enough time to back off and try again
+    def _last_attempt(self, attempt, delay, deadline):
+        return attempt == self.retries or self.clock() + delay >= deadline
+
+    def _release(self):
+        if self.limiter is not None:
+            self.limiter.release()
+
+    def stats(self):
+        with self._lock:
+            hosts = dict(self._hosts)
+        return {
+            netloc: {
+                'circuit': host.breaker.state,
+                'requests': host.requests,
+                'failures': host.failures,
+                'retries': host.retries,
+                'rejected': host.rejected,
+                'shed': host.shed,
+                'responses': {str(code): count for code, count in sorted(host.responses.items())},
+                'latency_seconds': host.latency.snapshot(),
+            }
+            for netloc, host in hosts.items()
+        }